@@ -0,0 +1,51 @@
+import sys
+import time
+import numpy as np
+from kitsune_core.AfterImageBackend import BACKENDS, available_backends, load_backend
+
+# Parity and speed check of the AfterImage backends on the LiveFeatureExtractor expansion workload:
+# one decayed 1D stream per base feature and lambda, updated with every packet.
+# usage: python benchmark_afterimage.py [packets]
+
+LAMBDA_VALUES = [5, 3, 1, 0.1, 0.01]
+N_STREAMS = 100
+
+
+def run(backend, timestamps, values):
+    db = backend.incStatDB(limit=1000000)
+    out = np.empty((len(timestamps), N_STREAMS * len(LAMBDA_VALUES) * 3))
+    ids = [str(i) for i in range(N_STREAMS)]
+    start = time.perf_counter()
+    for k, (t, row) in enumerate(zip(timestamps, values)):
+        col = 0
+        for i, v in enumerate(row):
+            for lam in LAMBDA_VALUES:
+                out[k, col:col + 3] = db.update_get_1D_Stats(ids[i], t, v, lam)
+                col += 3
+    return out, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rng = np.random.default_rng(0)
+    timestamps = np.cumsum(rng.exponential(0.01, n)).tolist()
+    values = rng.lognormal(4, 1, (n, N_STREAMS)).tolist()
+
+    names = available_backends()
+    missing = [name for name in BACKENDS if name not in names]
+    if missing:
+        print("⚠️ Not available: " + ", ".join(missing) + " (build the extension with: python setup.py build_ext --inplace)")
+    print(f"📦 Default backend: {load_backend().__name__}")
+
+    results = {name: run(load_backend(name), timestamps, values) for name in names}
+    ref, ref_time = results["python"]
+    print(f"⏱️ {n} packets x {N_STREAMS * len(LAMBDA_VALUES)} streams")
+    for name, (out, elapsed) in results.items():
+        diff = np.abs(out - ref)
+        scale = np.maximum(np.abs(ref), 1e-12)
+        print(f"  {name:8s} {elapsed:7.2f} s  {n / elapsed:9.1f} pkt/s  speedup {ref_time / elapsed:5.1f}x  "
+              f"max abs diff {np.nanmax(diff):.3g}  max rel diff {np.nanmax(diff / scale):.3g}")
+        if not np.allclose(out, ref, rtol=1e-9, atol=1e-9, equal_nan=True):
+            print(f"❌ {name} does not match the pure-Python backend")
+            sys.exit(1)
+    print("✅ All backends agree")
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import inspect
+import tempfile
+import importlib
+import subprocess
+import tracemalloc
+import numpy as np
+
+# Per-packet memory allocation of netStat.updateGetStats, with a fresh result vector per packet
+# (out=None) and writing into one reusable buffer / the rows of a batch matrix (out=...).
+# The traffic is a fixed set of flows, so after the warm-up no new streams are created and every
+# allocation is a per-packet temporary or result. Reported per packet:
+#   allocs:    calls to the Python and C allocators (objects, NumPy arrays and their buffers), counted with memray
+#              (pip install memray); the cost of the benchmark loop itself is measured on an empty call and
+#              subtracted. Tracing makes Python create a frame object for every function call, which it otherwise
+#              doesn't, so each call made per packet counts as one allocation here
+#   peak:      median transient peak measured with tracemalloc (bytes allocated on top of what was held before)
+#   retained:  mean bytes still held afterwards (the result vector; table growth is amortized into it)
+#   time:      wall time per packet, without any tracing
+# Each is measured on its own stretch of traffic, after the same warm-up.
+# usage: python benchmark_allocations.py [packets] [objects|arrays] [--baseline DIR]
+#   --baseline DIR: also measure the netStat of another checkout of the repository in a subprocess, e.g. the
+#   tree before out= existed (git worktree add /tmp/ntb-before <commit>); only the modes it supports are run
+
+WARMUP = 20000
+MODES = ("new vector", "out=buffer", "out=batch row")
+
+
+def synthetic_packets(n, seed=0):
+    rng = np.random.default_rng(seed)
+    hosts = ["10.0.0.%d" % (i + 1) for i in range(50)]
+    macs = ["02:00:00:00:00:%02x" % i for i in range(50)]
+    ports = [str(p) for p in (53, 80, 443, 8080)]
+    t = np.cumsum(rng.exponential(0.001, n))
+    src = rng.integers(0, len(hosts), n)
+    dst = rng.integers(0, len(hosts), n)
+    return [(0, macs[s], macs[d], hosts[s], str(40000 + d % 4), hosts[d], ports[d % len(ports)],
+             int(rng.integers(60, 1500)), float(t[k])) for k, (s, d) in enumerate(zip(src, dst))]
+
+
+# calls update(*fields) or update(*fields, out=...) for every packet, as the given mode does
+def _replay(update, packets, mode, buf, batch):
+    if mode == "new vector":
+        for fields in packets:
+            x = update(*fields)
+    elif mode == "out=buffer":
+        for fields in packets:
+            x = update(*fields, out=buf)
+    else:
+        for fields, row in zip(packets, batch):
+            x = update(*fields, out=row)
+
+
+def _empty_update(*fields, out=None):
+    return out
+
+
+# allocator calls made by replaying packets, as memray records them
+def _count_allocations(update, packets, mode, buf, batch):
+    import memray
+    frees = (memray.AllocatorType.FREE, memray.AllocatorType.PYMALLOC_FREE, memray.AllocatorType.MUNMAP)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "allocations.bin")
+        with memray.Tracker(path, trace_python_allocators=True, native_traces=False):
+            _replay(update, packets, mode, buf, batch)
+        return sum(r.n_allocations for r in memray.FileReader(path).get_allocation_records()
+                   if r.allocator not in frees)
+
+
+def run(ns, packets, n, store, mode):
+    kwargs = {"store": store} if "store" in inspect.signature(ns.netStat).parameters else {}
+    nstat = ns.netStat(np.nan, 1000000, 1000000, **kwargs)
+    n_stats = len(nstat.getNetStatHeaders())
+    buf = np.empty(n_stats)
+    batch = np.empty((n, n_stats))
+    # warm up (every flow's streams, lazily imported code) outside the measurement
+    for fields in packets[:WARMUP]:
+        nstat.updateGetStats(*fields)
+    timed, traced, counted = (packets[WARMUP + i * n:WARMUP + (i + 1) * n] for i in range(3))
+
+    start = time.perf_counter()
+    _replay(nstat.updateGetStats, timed, mode, buf, batch)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = []
+    held = 0
+    for fields, row in zip(traced, batch):
+        before = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        if mode == "new vector":
+            x = nstat.updateGetStats(*fields)
+        elif mode == "out=buffer":
+            x = nstat.updateGetStats(*fields, out=buf)
+        else:
+            x = nstat.updateGetStats(*fields, out=row)
+        current, top = tracemalloc.get_traced_memory()
+        peaks.append(top - before)
+        held += current - before
+        del x
+    tracemalloc.stop()
+
+    try:
+        allocs = (_count_allocations(nstat.updateGetStats, counted, mode, buf, batch) -
+                  _count_allocations(_empty_update, counted, mode, buf, batch)) / n
+    except ImportError:
+        allocs = None
+    return allocs, np.median(peaks), held / n, elapsed / n
+
+
+def report(n, store, tree=None):
+    if tree is not None:
+        sys.path.insert(0, os.path.abspath(tree))
+    ns = importlib.import_module("kitsune_core.netStat")
+    modes = MODES if "out" in inspect.signature(ns.netStat.updateGetStats).parameters else MODES[:1]
+    packets = synthetic_packets(3 * n + WARMUP)
+    print(f"⏱️ {n} packets, {store} store, netStat of {os.path.dirname(os.path.dirname(ns.__file__))}")
+    for mode in modes:
+        allocs, peak, held, elapsed = run(ns, packets, n, store, mode)
+        allocs = "   (memray not installed)" if allocs is None else f"{allocs:7.1f} allocs/pkt"
+        print(f"  {mode:14s} {allocs}  transient peak {peak:6.0f} B/pkt  retained {held:6.0f} B/pkt  "
+              f"{elapsed * 1e6:6.1f} µs/pkt")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    tree = baseline = None
+    if "--tree" in args:  # (how --baseline runs the other checkout)
+        tree = args.pop(args.index("--tree") + 1)
+        args.remove("--tree")
+    if "--baseline" in args:
+        baseline = args.pop(args.index("--baseline") + 1)
+        args.remove("--baseline")
+    n = int(args[0]) if len(args) > 0 else 3000
+    store = args[1] if len(args) > 1 else "objects"
+    if baseline is not None:
+        subprocess.run([sys.executable, os.path.abspath(__file__), str(n), store, "--tree", baseline], check=True)
+    report(n, store, tree)
@@ -0,0 +1,85 @@
+import sys
+import time
+import threading
+import numpy as np
+from my_feature_extractor import LiveFeatureExtractor
+from sniffer_pipeline import BoundedStage
+from benchmark_allocations import synthetic_packets
+from voting_system import is_packet_malicious, classify_batch, required_feature_indices, registry
+
+# Throughput and latency of the inference stage as a function of the micro-batching window
+# (max_batch packets or max_wait seconds, whichever comes first; see live_sniffer.INFERENCE_BATCH).
+# Feature vectors come from LiveFeatureExtractor over synthetic traffic. For every window:
+#   saturated: all vectors queued at once, packets voted on per second
+#   offered load: vectors submitted at a fixed rate, latency from submission to verdict (p50 / p99),
+#                 and the rate the stage kept up with
+# "per packet" is the unbatched stage calling is_packet_malicious() once per vector. The engine is
+# voting_system.VOTING_ENGINE (NTB_VOTING_ENGINE).
+# usage: python benchmark_voting.py [packets] [offered pkt/s]
+
+WINDOWS = [(None, 0.0), (1, 0.0), (8, 0.002), (32, 0.005), (64, 0.005), (128, 0.01), (256, 0.02)]
+
+
+def feature_vectors(n):
+    extractor = LiveFeatureExtractor(required_features=required_feature_indices())
+    return np.stack([extractor.process_fields(fields) for fields in synthetic_packets(n)])
+
+
+def run_stage(vectors, max_batch, max_wait, rate=0):
+    done_at = np.zeros(len(vectors))
+    verdicts = [None] * len(vectors)
+    finished = threading.Event()
+    remaining = [len(vectors)]
+
+    def record(k, verdict):
+        verdicts[k] = verdict
+        done_at[k] = time.perf_counter()
+        remaining[0] -= 1
+        if remaining[0] == 0:
+            finished.set()
+
+    if max_batch is None:
+        def handler(item):
+            record(item, is_packet_malicious(vectors[item]))
+    else:
+        def handler(items):
+            for k, verdict in zip(items, classify_batch(vectors[items])):
+                record(k, verdict)
+            return [None] * len(items)
+
+    stage = BoundedStage("inference", handler, depth=len(vectors) + 1, drop_policy="block",
+                         max_batch=max_batch, max_wait=max_wait)
+    stage.start()
+    submitted_at = np.zeros(len(vectors))
+    start = time.perf_counter()
+    for k in range(len(vectors)):
+        if rate > 0:
+            delay = start + k / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        submitted_at[k] = time.perf_counter()
+        stage.submit(k)
+    finished.wait()
+    stage.stop()
+    elapsed = done_at.max() - start
+    return verdicts, len(vectors) / elapsed, (done_at - submitted_at) * 1000
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 500
+    vectors = feature_vectors(n)
+    registry.load()
+    print(registry.format_load_times())
+    print(f"⏱️ {n} packets, offered load {rate:g} pkt/s, {registry.engine} engine")
+    reference = None
+    for max_batch, max_wait in WINDOWS:
+        verdicts, throughput, _ = run_stage(vectors, max_batch, max_wait)
+        _, achieved, latency = run_stage(vectors, max_batch, max_wait, rate)
+        if reference is None:
+            reference = verdicts
+        window = "per packet" if max_batch is None else f"{max_batch} pkt / {max_wait * 1000:g} ms"
+        same = sum(a == b for a, b in zip(verdicts, reference))
+        print(f"  {window:18s} saturated {throughput:8.1f} pkt/s | at {rate:g} pkt/s: {achieved:8.1f} pkt/s "
+              f"p50 {np.percentile(latency, 50):8.2f} ms  p99 {np.percentile(latency, 99):8.2f} ms | "
+              f"verdicts matching per packet {same}/{n}")
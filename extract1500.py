@@ -21,7 +21,7 @@ for filename in os.listdir(pcap_dir):
     print(f"Extracting up to {MAX_ROWS} packets worth of AfterImage features...")
 
     # Initialize Kitsune Feature Extractor
-    extractor = FE(pcap_path)
+    extractor = FE(pcap_path, limit=MAX_ROWS)
     features = []
     count = 0
 
@@ -29,8 +29,10 @@ for filename in os.listdir(pcap_dir):
     with tqdm(total=MAX_ROWS, desc=f"Extracting {filename}") as pbar:
         while count < MAX_ROWS:
             feat = extractor.get_next_vector()
-            if feat is None:
+            if feat is None:  # end of capture
                 break
+            if len(feat) == 0:  # a packet that failed to parse
+                continue
             features.append(feat)
             count += 1
             pbar.update(1)
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Column layout of the LiveFeatureExtractor feature vector:
+#   [0, N_BASE_FEATURES)    the netStat statistics (netStat.getNetStatHeaders())
+#   [N_BASE_FEATURES, ...)  the AfterImage expansion: (weight, mean, std) of a decayed stream over every base
+#                           feature at every lambda, ordered by base feature, then lambda, then stat
+LAMBDA_VALUES = [5, 3, 1, 0.1, 0.01]
+EXPANSION_STATS = ("weight", "mean", "std")
+N_BASE_FEATURES = 100  # netStat output
+N_FEATURES = N_BASE_FEATURES * (1 + len(EXPANSION_STATS) * len(LAMBDA_VALUES))
+
+
+# Column of the output vector holding stat (0 weight, 1 mean, 2 std) of the AfterImage stream
+# over base feature `feature` at LAMBDA_VALUES[lambda_index]
+def afterimage_column(feature, lambda_index, stat=0):
+    return N_BASE_FEATURES + (feature * len(LAMBDA_VALUES) + lambda_index) * len(EXPANSION_STATS) + stat
+
+
+# A fixed set of columns, resolved once: take() is a zero-copy slice view when the columns are contiguous
+# and ascending, and a single fancy-index gather otherwise
+class ColumnSelection:
+    def __init__(self, columns):
+        self.columns = np.asarray(columns, dtype=np.intp)
+        n = len(self.columns)
+        self.contiguous = n > 0 and bool((np.diff(self.columns) == 1).all())
+        self.key = slice(int(self.columns[0]), int(self.columns[0]) + n) if self.contiguous else self.columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    # X: a feature vector or an (N, n_features) matrix; selects along the last axis
+    def take(self, X):
+        return X[..., self.key]
+
+
+# Names and column indices of the feature vector: the netStat headers followed by the expansion columns,
+# named "<base header>:<lambda>_<stat>" (e.g. "HH_jit_0.1_mean:5_std")
+class FeatureSchema:
+    def __init__(self, base_headers, lambdas=LAMBDA_VALUES):
+        self.base_headers = list(base_headers)
+        self.lambdas = list(lambdas)
+        self.names = list(self.base_headers)
+        for header in self.base_headers:
+            for lam in self.lambdas:
+                self.names += [f"{header}:{lam}_{stat}" for stat in EXPANSION_STATS]
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    # Schema of a netStat's output plus the expansion LiveFeatureExtractor builds over it
+    @classmethod
+    def from_netstat(cls, nstat, lambdas=LAMBDA_VALUES):
+        return cls(nstat.getNetStatHeaders(), lambdas)
+
+    @property
+    def n_base(self):
+        return len(self.base_headers)
+
+    def __len__(self):
+        return len(self.names)
+
+    def column(self, name):
+        return self.index[name]
+
+    # the len(lambdas) * 3 expansion columns of base feature `feature` (an index or a header)
+    def expansion_columns(self, feature):
+        if isinstance(feature, str):
+            feature = self.base_headers.index(feature)
+        width = len(self.lambdas) * len(EXPANSION_STATS)
+        start = self.n_base + feature * width
+        return range(start, start + width)
+
+    # columns: indices or names
+    def select(self, columns):
+        return ColumnSelection([self.index[c] if isinstance(c, str) else c for c in columns])
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import numpy as np
+import keras
+from keras import layers, ops
+from numpy_ensemble import model_sources
+
+# One Keras model for the whole voting ensemble: the input is the union of the feature vector columns the
+# models read (voting_system.required_feature_indices()), and the outputs are every model's probabilities,
+# one (N, 1) output per head, from a single forward pass.
+# Each head gathers its columns, standardizes them in float64 exactly as its StandardScaler.transform() does,
+# casts to float32 as Keras does on predict(), and runs copies of the original Dense layers, so the head
+# outputs are the ones the separate models produce. Run it with predict_on_batch(): predict() rounds float64
+# inputs to float32 before the scaling. The heads are not concatenated into one output since that changes
+# how TensorFlow fuses the last Dense layers and with it the rounding of the probabilities.
+# Export after retraining or changing top15features.csv: python fused_ensemble.py
+# The artifact is models/ensemble_fused.keras, with the head order and input columns in ensemble_fused.json.
+
+FUSED_MODEL_FILE = "ensemble_fused.keras"
+FUSED_META_FILE = "ensemble_fused.json"
+
+
+# (x[:, positions] - mean) / scale in float64, cast to float32
+# (autocast is off: Keras would otherwise round the float64 input to float32 before scaling)
+@keras.saving.register_keras_serializable(package="NotTodayBot")
+class ScaledColumns(layers.Layer):
+    def __init__(self, positions, mean, scale, **kwargs):
+        super().__init__(autocast=False, **kwargs)
+        self.positions = [int(p) for p in positions]
+        self.mean = [float(m) for m in mean]
+        self.scale = [float(s) for s in scale]
+
+    def call(self, inputs):
+        x = ops.take(ops.cast(inputs, "float64"), np.array(self.positions), axis=1)
+        x = (x - np.array(self.mean, dtype=np.float64)) / np.array(self.scale, dtype=np.float64)
+        return ops.cast(x, "float32")
+
+    def get_config(self):
+        config = super().get_config()
+        config.update(positions=self.positions, mean=self.mean, scale=self.scale)
+        return config
+
+
+# heads: (name, columns, scaler, model) per ensemble member; columns are feature vector columns
+# Returns the fused model and its input columns (the sorted union of every head's columns)
+def build_fused_model(heads):
+    columns = sorted(set(c for _, head_columns, _, _ in heads for c in head_columns))
+    position = {c: i for i, c in enumerate(columns)}
+    inputs = keras.Input(shape=(len(columns),), dtype="float64", name="features")
+    outputs = []
+    for name, head_columns, scaler, model in heads:
+        slug = name.replace(" ", "_")
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(len(head_columns))
+        scale = scaler.scale_ if scaler.with_std else np.ones(len(head_columns))
+        x = ScaledColumns([position[c] for c in head_columns], mean, scale, name=f"{slug}_scaled")(inputs)
+        for layer in model.layers:
+            copy = layer.__class__.from_config({**layer.get_config(), "name": f"{slug}_{layer.name}"})
+            x = copy(x)
+            copy.set_weights(layer.get_weights())
+        outputs.append(x)
+    return keras.Model(inputs, outputs, name="voting_ensemble"), columns
+
+
+# True if the export exists, covers exactly model_files and is newer than all of them
+def is_current(model_dir, model_files, features_csv):
+    path = os.path.join(model_dir, FUSED_MODEL_FILE)
+    meta_path = os.path.join(model_dir, FUSED_META_FILE)
+    if not os.path.exists(path) or not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        if sorted(json.load(f)["model_files"]) != sorted(model_files):
+            return False
+    exported = os.path.getmtime(path)
+    return all(os.path.getmtime(p) <= exported
+               for p in model_sources(model_dir, model_files, features_csv) if os.path.exists(p))
+
+
+# Returns (model, meta); meta holds "model_files" (head order), "heads" (attack keys) and "columns"
+def load_fused(model_dir):
+    with open(os.path.join(model_dir, FUSED_META_FILE)) as f:
+        meta = json.load(f)
+    model = keras.saving.load_model(os.path.join(model_dir, FUSED_MODEL_FILE))
+    return model, meta
+
+
+# Fuses a voting_system.ModelRegistry loaded with the keras engine and saves it to its model_dir
+def export(registry):
+    heads = [(attack_key, registry.model_columns[mf].columns.tolist(), registry.scalers[mf], model)
+             for mf, attack_key, model in zip(registry.model_files, registry.attack_keys, registry.models)]
+    model, columns = build_fused_model(heads)
+    model.save(os.path.join(registry.model_dir, FUSED_MODEL_FILE))
+    with open(os.path.join(registry.model_dir, FUSED_META_FILE), "w") as f:
+        json.dump({"model_files": registry.model_files, "heads": registry.attack_keys, "columns": columns}, f,
+                  indent=2)
+    return model, heads, columns
+
+
+if __name__ == "__main__":
+    from voting_system import ModelRegistry
+    registry = ModelRegistry(engine="keras", lazy=False, warmup=False)
+    model, heads, columns = export(registry)
+    print(f"📦 Fused {len(heads)} models over {len(columns)} input columns into "
+          f"{os.path.join(registry.model_dir, FUSED_MODEL_FILE)}")
+
+    # every head must reproduce its model bit for bit
+    X = np.random.default_rng(0).normal(0, 100, (256, len(registry.schema)))
+    fused = model.predict_on_batch(X[:, columns])
+    mismatched = 0
+    for k, (name, head_columns, scaler, head_model) in enumerate(heads):
+        separate = head_model.predict(scaler.transform(X[:, head_columns]), batch_size=len(X), verbose=0)
+        mismatched += int((fused[k] != separate).sum())
+    print(f"🔍 {mismatched} head outputs differ from the separate models on {len(X)} random vectors")
+
+    start = time.perf_counter()
+    load_fused(registry.model_dir)
+    print(f"⏱️ Fused model loads in {time.perf_counter() - start:.2f}s")
@@ -1,4 +1,7 @@
+import functools
+import heapq
 import math
+from collections import OrderedDict
 import numpy as np
 
 
@@ -423,20 +426,622 @@ class incStatDB:
         return [str(Lambda)+"_"+s for s in hdrs]
 
 
-    #cleans out records that have a weight less than the cutoff.
-    #returns number or removed records.
+    #cleans out records that have a weight less than the cutoff (one O(n) pass; see incStatDBMulti.expire
+    #for the incremental version). returns number or removed records.
     def cleanOutOldRecords(self,cutoffWeight,curTime):
         n = 0
-        dump = sorted(self.HT.items(), key=lambda tup: tup[1][0].getMaxW(curTime))
-        for entry in dump:
-            entry[1][0].processDecay(curTime)
-            W = entry[1][0].w
-            if W <= cutoffWeight:
-                key = entry[0]
-                del entry[1][0]
+        for key, incS in list(self.HT.items()):
+            incS.processDecay(curTime)
+            if incS.w <= cutoffWeight:
                 del self.HT[key]
+                for cov in incS.covs:
+                    for other in cov.incStats:
+                        if other is not incS and cov in other.covs:
+                            other.covs.remove(cov)
+                incS.covs = []
                 n=n+1
-            elif W > cutoffWeight:
-                break
         return n
 
+
+
+# Multi-lambda variants of incStat, incStat_cov and incStatDB.
+# One record tracks a stream at every Lambda at once: CF1, CF2 and w (and CF3, w3 and the residuals
+# for covariances) are small arrays with one entry per Lambda, so a packet decays and updates all
+# windows in one vectorized step and costs one table lookup instead of one per Lambda.
+# The arithmetic mirrors the per-Lambda classes operation for operation (including when mean/var/std
+# are cached), so the statistics are bit-identical to running incStatDB once per Lambda. Powers (decay
+# factors and squares) go through math.pow per Lambda: numpy's vectorized power and x*x are not
+# bit-identical to it.
+# The per-packet arithmetic runs in place, on the records' own arrays and on work arrays shared by the
+# records of a table (_Scratch), as same-shape ufuncs with out=: those allocate nothing, where temporary
+# results, broadcasting and every row view (S[0]) do.
+
+# streams updated by the same packet often decay by the same timeDiff, so factors are memoized
+# (the returned arrays are shared: never modify them in place). They come tiled to the shapes they scale:
+# (3, n) for incStatMulti.S, and (4, n) for incStat_covMulti.R when stream 0 or 1 produced the update, with
+# ones in the row of the other stream's residual (which isn't decayed; x * 1.0 is exactly x)
+@functools.lru_cache(maxsize=256)
+def _decay_factors(neg_Lambdas, timeDiff):
+    F = np.empty((11, len(neg_Lambdas)))
+    F[:] = [math.pow(2, nl * timeDiff) for nl in neg_Lambdas]
+    F[6] = 1
+    F[7] = 1
+    return F[:3], (F[3:7], F[7:])
+
+# squares of a, into out if given
+def _sq(a, out=None):
+    if out is None:
+        return np.array([math.pow(x, 2) for x in a.tolist()])
+    for i, x in enumerate(a.tolist()):
+        out[i] = math.pow(x, 2)
+    return out
+
+
+# Work arrays of width n shared by the records of one table (which, like the records, is only ever updated by
+# one thread at a time). Their rows are unpacked once, since slicing a row out allocates a view every time.
+class _Scratch:
+    def __init__(self, n):
+        self.S = np.empty((3, n))  # a copy of incStatMulti.S
+        self.S0, self.S1, self.S2 = self.S
+        self.ins = np.ones((3, n))  # what an insert adds to S: (v, v**2, 1)
+        self.ins0, self.ins1, _ = self.ins
+        self.R = np.empty((4, n))  # a copy of incStat_covMulti.R
+        self.R_rows = tuple(self.R)
+        self.stats1 = np.empty((3, n))  # allstats_1D / get_stats2 results, copied to the caller's out in one go
+        self.stats1_rows = tuple(self.stats1)
+        self.stats2 = np.empty((4, n))
+        self.stats2_rows = tuple(self.stats2)
+        self.a = np.empty(n)
+        self.b = np.empty(n)
+        self.nonzero = np.empty(n, dtype=bool)
+        self.zeros = np.zeros(n)
+        self.ones = np.ones(n)
+        self.v = np.empty(())  # an inserted value, as an array operand
+
+# time at which weights w (one per Lambda, as of lastTimestamp) have all decayed to cutoffWeight
+def _expiry_time(w, lastTimestamp, Lambdas, cutoffWeight):
+    live = w > cutoffWeight
+    if not live.any():
+        return lastTimestamp
+    return lastTimestamp + float(np.max(np.log2(w[live] / cutoffWeight) / np.asarray(Lambdas)[live]))
+
+# _expiry_time of many records at once: W (n, n_lambdas), lastTimestamps (n,)
+def _expiry_times(W, lastTimestamps, Lambdas, cutoffWeight):
+    with np.errstate(divide='ignore'):
+        t = np.where(W > cutoffWeight, np.log2(W / cutoffWeight) / np.asarray(Lambdas), 0)
+    return lastTimestamps + (t.max(axis=1) if len(t) else 0)
+
+# Table snapshots (get_state/load_state of incStatDBMulti and AfterImageSoA.incStatDBSoA) share one layout,
+# so a snapshot of either store loads into the other. Streams and covariances are numbered slots:
+#   order (n,): slots of the n streams, from least to most recently used
+#   keys (slots, 2): stream IDs (an int k is stored as (k, -1)), used (slots,): slot holds a stream
+#   S (slots, 3, L) CF1/CF2/w, M (slots, 2, L) mean/var, last (slots,), typediff (slots,)
+#   C (covs, 4, L) as incStat_covMulti.R, at every Lambda even if a tracker tracks fewer (see _full_width_covs), last3 (covs,), ends (covs, 2): stream slots of each cov (-1: free)
+#   adj_ptr (slots + 1,), adj: the covs of slot s, in order, are adj[adj_ptr[s]:adj_ptr[s + 1]] (register_cov
+#   returns the first match, so the order matters; a stream's covariance with itself is listed twice)
+#   cached (slots, 3), std (slots, L): which of mean/var/std an incStatMulti had cached (object store only)
+# plus the eviction/expiry counters. Stream IDs must be ints or pairs of ints (netStat's interned keys).
+def _encode_key(ID):
+    return ID if isinstance(ID, tuple) else (ID, -1)
+
+# The C array of the layout for covariance trackers that may track a subset of the Lambdas: untracked columns
+# hold a new tracker's values (loading the snapshot with them tracked starts them from scratch)
+def _full_width_covs(covs, n_lambdas):
+    C = np.zeros((len(covs), 4, n_lambdas))
+    C[:, 2] = 1e-20
+    for c, cov in enumerate(covs):
+        if cov.lambdas is None:
+            C[c] = cov.R
+        else:
+            C[c][:, cov.lambdas] = cov.R
+    return C
+
+# An index of the Lambdas (n_lambdas of them) with the given indices: None for all of them, a slice when they are
+# contiguous (basic slicing is far cheaper than fancy indexing on the per-packet path), an index array otherwise
+def _lambda_index(lambdas, n_lambdas):
+    if lambdas is None or len(lambdas) == n_lambdas:
+        return None
+    lambdas = sorted(int(i) for i in lambdas)
+    if lambdas == list(range(lambdas[0], lambdas[-1] + 1)):
+        return slice(lambdas[0], lambdas[-1] + 1)
+    return np.array(lambdas, dtype=np.intp)
+
+def _decode_keys(keys):
+    first = keys[:, 0].tolist()
+    if (keys[:, 1] == -1).all():
+        return first
+    return [a if b == -1 else (a, b) for a, b in zip(first, keys[:, 1].tolist())]
+
+
+class incStatMulti:
+    # scratch: the _Scratch of the table (default: a private one)
+    def __init__(self, Lambdas, ID, init_time=0, isTypeDiff=False, scratch=None):  # Lambdas: tuple of decay factors
+        self.ID = ID
+        self.Lambdas = Lambdas
+        self.neg_Lambdas = tuple(-l for l in Lambdas)
+        self.S = np.zeros((3, len(Lambdas)))  # rows: CF1 (linear sum), CF2 (sum of squares), w (weight)
+        self.S[2] = 1e-20
+        self.isTypeDiff = isTypeDiff
+        self.lastTimestamp = init_time
+        self.cur_mean = None  # cached per-Lambda stats (None: recalculate when called)
+        self.cur_var = None
+        self.cur_std = None
+        self.stat_arrays = None  # (mean, var, std) arrays the cached stats are computed into, made on first use
+        self.scratch = _Scratch(len(Lambdas)) if scratch is None else scratch
+        self.covs = []  # a list of incStat_covMulti (references) with relate to this incStat
+
+    def insert(self, v, t=0):  # v is a scalar, t is v's arrival the timestamp
+        if self.isTypeDiff:
+            dif = t - self.lastTimestamp
+            if dif > 0:
+                v = dif
+            else:
+                v = 0
+        self.processDecay(t)
+
+        # update with v
+        sc = self.scratch
+        sc.ins0[...] = v
+        sc.ins1[...] = math.pow(v, 2)
+        np.add(self.S, sc.ins, out=self.S)
+        self.cur_mean = None  # force recalculation if called
+        self.cur_var = None
+        self.cur_std = None
+
+        # update covs (if any)
+        for cov in self.covs:
+            cov.update_cov(self.ID, v, t)
+
+    def processDecay(self, timestamp):
+        # check for decay
+        timeDiff = timestamp - self.lastTimestamp
+        if timeDiff > 0:
+            np.multiply(self.S, _decay_factors(self.neg_Lambdas, timeDiff)[0], out=self.S)
+            self.lastTimestamp = timestamp
+
+    def weight(self):
+        return self.S[2]
+
+    def _stat_arrays(self):
+        if self.stat_arrays is None:
+            L = len(self.Lambdas)
+            self.stat_arrays = (np.empty(L), np.empty(L), np.empty(L))
+        return self.stat_arrays
+
+    def mean(self):
+        if self.cur_mean is None:  # calculate it only once when necessary
+            sc = self.scratch
+            sc.S[...] = self.S
+            self.cur_mean = np.divide(sc.S0, sc.S2, out=self._stat_arrays()[0])
+        return self.cur_mean
+
+    def var(self):
+        if self.cur_var is None:  # calculate it only once when necessary
+            sc = self.scratch
+            sc.S[...] = self.S
+            var = np.divide(sc.S1, sc.S2, out=self._stat_arrays()[1])
+            np.subtract(var, _sq(self.mean(), sc.a), out=var)
+            self.cur_var = np.abs(var, out=var)
+        return self.cur_var
+
+    def std(self):
+        if self.cur_std is None:  # calculate it only once when necessary
+            self.cur_std = np.sqrt(self.var(), out=self._stat_arrays()[2])
+        return self.cur_std
+
+    def radius(self, other_incStats):  # the radius of a set of incStats
+        A = _sq(self.var())
+        for incS in other_incStats:
+            A = A + _sq(incS.var())
+        return np.sqrt(A)
+
+    def magnitude(self, other_incStats):  # the magnitude of a set of incStats
+        A = _sq(self.mean())
+        for incS in other_incStats:
+            A = A + _sq(incS.mean())
+        return np.sqrt(A)
+
+    # time at which the weight has decayed to cutoffWeight at every Lambda (lastTimestamp if it already has)
+    def expiry_time(self, cutoffWeight):
+        return _expiry_time(self.S[2], self.lastTimestamp, self.Lambdas, cutoffWeight)
+
+    # calculates and pulls all stats on this stream: array of shape (3, n_lambdas) [weight, mean, var]
+    # out: optional (3, n_lambdas) array (or view) to write them into
+    def allstats_1D(self, out=None):
+        if out is None:
+            out = np.empty((3, len(self.Lambdas)))
+        sc = self.scratch
+        sc.S[...] = self.S
+        mean, var, _ = self._stat_arrays()
+        self.cur_mean = np.divide(sc.S0, sc.S2, out=mean)
+        np.divide(sc.S1, sc.S2, out=var)
+        np.subtract(var, _sq(mean, sc.a), out=var)
+        self.cur_var = np.abs(var, out=var)
+        # (assembled contiguously, so the strided copy into out is a single one)
+        w_row, mean_row, var_row = sc.stats1_rows
+        w_row[...] = sc.S2
+        mean_row[...] = mean
+        var_row[...] = var
+        out[...] = sc.stats1
+        return out
+
+
+# like incStatMulti, but maintains stats between two streams
+# lambdas: the streams' Lambdas to track, as _lambda_index() returns (None: all of them); the 2D stats of the
+# others are NaN
+# scratch: a _Scratch as wide as the tracked Lambdas, shared with the table (default: the first stream's, or a
+# private one if only some are tracked)
+class incStat_covMulti:
+    def __init__(self, incS1, incS2, init_time=0, lambdas=None, scratch=None):
+        # store references tot he streams' incStats
+        self.incStats = [incS1, incS2]
+        self.lambdas = lambdas
+        if lambdas is None:
+            self.Lambdas, self.neg_Lambdas = incS1.Lambdas, incS1.neg_Lambdas
+        elif isinstance(lambdas, slice):
+            self.Lambdas, self.neg_Lambdas = incS1.Lambdas[lambdas], incS1.neg_Lambdas[lambdas]
+        else:
+            self.Lambdas = tuple(incS1.Lambdas[i] for i in lambdas)
+            self.neg_Lambdas = tuple(incS1.neg_Lambdas[i] for i in lambdas)
+        # rows: lastRes of stream 0, CF3 (sum of residule products (A-uA)(B-uB)), w3, lastRes of stream 1
+        # (so the rows decayed together for stream i are the contiguous block R[i:i+3])
+        self.R = np.zeros((4, len(self.Lambdas)))
+        self.R[2] = 1e-20
+        self.lastTimestamp_cf3 = init_time
+        if scratch is None:
+            scratch = incS1.scratch if lambdas is None else _Scratch(len(self.Lambdas))
+        self.scratch = scratch
+
+    # ID: the stream ID which produced (v,t)
+    def update_cov(self, ID, v, t):  # assumes incStat "ID" has ALREADY been updated with (t,v)
+        # find incStat
+        if ID == self.incStats[0].ID:
+            inc = 0
+        elif ID == self.incStats[1].ID:
+            inc = 1
+        else:
+            print("update_cov ID error")
+            return ## error
+
+        # Decay other incStat
+        self.incStats[1 - inc].processDecay(t)
+
+        # Decay residules
+        self.processDecay(t, inc)
+
+        # Compute and update residule (on a copy of R, whose rows are unpacked in the scratch)
+        mean = self.incStats[inc].mean()
+        if self.lambdas is not None:
+            mean = mean[self.lambdas]
+        sc = self.scratch
+        sc.R[...] = self.R
+        R = sc.R_rows
+        sc.v[...] = v
+        res = np.subtract(sc.v, mean, out=R[3 * inc])
+        np.add(R[1], np.multiply(res, R[3 - 3 * inc], out=sc.a), out=R[1])
+        np.add(R[2], sc.ones, out=R[2])
+        self.R[...] = sc.R
+
+    def processDecay(self, t, micro_inc_indx):
+        # check for decay cf3
+        timeDiffs_cf3 = t - self.lastTimestamp_cf3
+        if timeDiffs_cf3 > 0:
+            # (CF3, w3 and the residual of stream micro_inc_indx, i.e. rows micro_inc_indx to micro_inc_indx + 2)
+            np.multiply(self.R, _decay_factors(self.neg_Lambdas, timeDiffs_cf3)[1][micro_inc_indx], out=self.R)
+            self.lastTimestamp_cf3 = t
+
+    # time at which w3 has decayed to cutoffWeight at every Lambda
+    def expiry_time(self, cutoffWeight):
+        return _expiry_time(self.R[2], self.lastTimestamp_cf3, self.Lambdas, cutoffWeight)
+
+    # covariance approximation
+    def cov(self):
+        return self.R[1] / self.R[2]
+
+    # Pearson corl. coef
+    def pcc(self):
+        ss = self.incStats[0].std() * self.incStats[1].std()
+        if self.lambdas is not None:
+            ss = ss[self.lambdas]
+        return np.divide(self.cov(), ss, out=np.zeros_like(ss), where=ss != 0)
+
+    # calculates and pulls all correlative stats AND 2D stats from both streams: shape (4, n_lambdas)
+    # out: optional (4, n_lambdas) array (or view) to write them into
+    def get_stats2(self, out=None):
+        if out is None:
+            out = np.empty((4, len(self.incStats[0].Lambdas)))
+        if self.lambdas is None:
+            # as radius(), magnitude(), cov() and pcc() compute them, assembled in the scratch
+            s0, s1 = self.incStats
+            sc = self.scratch
+            radius, magnitude, cov, pcc = sc.stats2_rows
+            np.sqrt(np.add(_sq(s0.var(), radius), _sq(s1.var(), sc.a), out=radius), out=radius)
+            np.sqrt(np.add(_sq(s0.mean(), magnitude), _sq(s1.mean(), sc.a), out=magnitude), out=magnitude)
+            sc.R[...] = self.R
+            np.divide(sc.R_rows[1], sc.R_rows[2], out=cov)
+            ss = np.multiply(s0.std(), s1.std(), out=sc.b)
+            pcc[...] = 0
+            np.divide(cov, ss, out=pcc, where=np.not_equal(ss, sc.zeros, out=sc.nonzero))
+            out[...] = sc.stats2
+            return out
+        # only the tracked Lambdas (radius and magnitude as radius()/magnitude() compute them)
+        idx = self.lambdas
+        s0, s1 = self.incStats
+        out[:] = np.nan
+        out[0, idx] = np.sqrt(_sq(s0.var()[idx]) + _sq(s1.var()[idx]))
+        out[1, idx] = np.sqrt(_sq(s0.mean()[idx]) + _sq(s1.mean()[idx]))
+        out[2, idx] = self.cov()
+        out[3, idx] = self.pcc()
+        return out
+
+
+class incStatDBMulti:
+    # Lambdas: the decay factors tracked for every stream.
+    # limit counts per-Lambda entries (as in incStatDB), i.e. at most limit/len(Lambdas) streams.
+    # evict: when the table is full, drop the least recently updated stream (and unlink its covariance
+    # trackers) instead of rejecting the new one, so the table stays within limit at O(1) amortized cost
+    # expire_weight: enables expire(): streams whose weight (and that of their covariance trackers) has decayed
+    # below this at every Lambda are dropped
+    def __init__(self, Lambdas, limit=np.inf, evict=False, expire_weight=None):
+        self.HT = OrderedDict() if evict else dict()  # evict: ordered from least to most recently used
+        self.Lambdas = tuple(Lambdas)
+        self.limit = limit
+        self.evict = evict
+        self.expire_weight = expire_weight
+        # lazy min-heap of (projected expiry time, seq, incStat); an entry is re-checked when it reaches the top,
+        # so updates never touch the heap (a stream updated since it was scheduled is simply rescheduled)
+        self.expiry_heap = []
+        self.expiry_seq = 0  # heap tie-breaker (IDs of different types don't compare)
+        self.evictions = 0  # streams evicted
+        self.expired = 0  # streams expired
+        self.evicted_covs = 0  # covariance trackers unlinked by evictions and expiry
+        self.cov_lambdas = None  # the Lambdas new covariance trackers track (None: all; see _lambda_index)
+        self.scratch = _Scratch(len(self.Lambdas))  # shared by the records (see _Scratch)
+        self.cov_scratch = self.scratch  # as wide as cov_lambdas
+        self._hdrs = incStatDB(limit)  # header formatting is shared with the per-Lambda DB
+
+    # Restricts new covariance trackers to the Lambdas with the given indices (None: all of them), so the 2D stats
+    # of the others cost nothing and are NaN. Trackers that already exist keep the Lambdas they were created with.
+    def set_cov_lambdas(self, lambdas=None):
+        self.cov_lambdas = _lambda_index(lambdas, len(self.Lambdas))
+        self.cov_scratch = self.scratch if self.cov_lambdas is None else \
+            _Scratch(len(np.arange(len(self.Lambdas))[self.cov_lambdas]))
+
+    # Registers a new stream. init_time: init lastTimestamp of the incStat
+    def register(self, ID, init_time=0, isTypeDiff=False):
+        incS = self.HT.get(ID)
+        if incS is None:  # does not already exist
+            if (len(self.HT) + 1) * len(self.Lambdas) > self.limit:
+                if not self.evict or not self.HT:
+                    raise LookupError(
+                        'Adding Entry:\n' + str(ID) + '\nwould exceed incStatHT 1D limit of ' + str(
+                            self.limit) + '.\nObservation Rejected.')
+                self.evict_lru()
+            incS = incStatMulti(self.Lambdas, ID, init_time, isTypeDiff, self.scratch)
+            self.HT[ID] = incS  # add new entry
+            if self.expire_weight is not None:
+                self._schedule(incS, init_time)
+        elif self.evict:
+            self.HT.move_to_end(ID)
+        return incS
+
+    # Removes the least recently used stream
+    def evict_lru(self):
+        ID, incS = self.HT.popitem(last=False)
+        self._unlink(incS)
+        self.evictions += 1
+        return ID
+
+    # Drops up to max_purge streams whose weight has decayed below expire_weight by curTime.
+    # Each call checks at most max_purge streams, so it can run on every packet. Returns the number removed.
+    def expire(self, curTime, max_purge=16):
+        heap = self.expiry_heap
+        if len(heap) > 2 * len(self.HT) + 64:  # mostly entries of evicted streams: compact (amortized O(1))
+            heap[:] = [e for e in heap if self.HT.get(e[2].ID) is e[2]]
+            heapq.heapify(heap)
+        n = 0
+        checked = 0
+        while heap and heap[0][0] <= curTime and checked < max_purge:
+            incS = heapq.heappop(heap)[2]
+            if self.HT.get(incS.ID) is not incS:
+                continue  # already evicted (each such entry is skipped once, so this is amortized O(1) per eviction)
+            checked += 1
+            # a stream stays while it or any of its covariance trackers still carries weight
+            # (e.g. a host that only ever receives has no weight of its own)
+            t_exp = incS.expiry_time(self.expire_weight)
+            for cov in incS.covs:
+                t_exp = max(t_exp, cov.expiry_time(self.expire_weight))
+            if t_exp <= curTime:
+                del self.HT[incS.ID]
+                self._unlink(incS)
+                n += 1
+            else:  # updated since it was scheduled
+                self._schedule(incS, t_exp)
+        self.expired += n
+        return n
+
+    def _schedule(self, incS, t_exp):
+        self.expiry_seq += 1
+        heapq.heappush(self.expiry_heap, (t_exp, self.expiry_seq, incS))
+
+    # Unlinks a removed stream from the streams it was correlated with
+    def _unlink(self, incS):
+        for cov in incS.covs:
+            other = cov.incStats[1] if cov.incStats[0] is incS else cov.incStats[0]
+            if other is not incS:
+                other.covs.remove(cov)
+            self.evicted_covs += 1
+        incS.covs = []
+
+    def stats(self):
+        return {"streams": len(self.HT), "evictions": self.evictions, "expired": self.expired,
+                "evicted_covs": self.evicted_covs}
+
+    # IDs of the streams in the table
+    def stream_ids(self):
+        return self.HT.keys()
+
+    # Copies the table into the snapshot layout described above _encode_key (stream i in slot i)
+    def get_state(self):
+        streams = list(self.HT.values())
+        n = len(streams)
+        L = len(self.Lambdas)
+        slot = {id(incS): i for i, incS in enumerate(streams)}
+        covs = []
+        cov_ids = {}
+        adj = []
+        for incS in streams:
+            for cov in incS.covs:
+                c = cov_ids.get(id(cov))
+                if c is None:
+                    c = cov_ids[id(cov)] = len(covs)
+                    covs.append(cov)
+                adj.append(c)
+
+        S = np.array([incS.S for incS in streams]).reshape(n, 3, L)
+        M = np.empty((n, 2, L))
+        std = np.zeros((n, L))
+        cached = np.zeros((n, 3), dtype=bool)
+        for i, incS in enumerate(streams):
+            # uncached values are stored as they would be computed now
+            cached[i] = (incS.cur_mean is not None, incS.cur_var is not None, incS.cur_std is not None)
+            M[i, 0] = incS.mean()
+            M[i, 1] = incS.var()
+            if cached[i, 2]:
+                std[i] = incS.cur_std
+            if not cached[i, 0]:
+                incS.cur_mean = None
+            if not cached[i, 1]:
+                incS.cur_var = None
+        return {
+            "order": np.arange(n),
+            "keys": np.array([_encode_key(incS.ID) for incS in streams], dtype=np.int64).reshape(n, 2),
+            "used": np.ones(n, dtype=bool),
+            "S": S,
+            "M": M,
+            "last": np.array([incS.lastTimestamp for incS in streams], dtype=np.float64),
+            "typediff": np.array([incS.isTypeDiff for incS in streams], dtype=bool),
+            "C": _full_width_covs(covs, L),
+            "last3": np.array([cov.lastTimestamp_cf3 for cov in covs], dtype=np.float64),
+            "ends": np.array([(slot[id(cov.incStats[0])], slot[id(cov.incStats[1])]) for cov in covs],
+                             dtype=np.int64).reshape(len(covs), 2),
+            "adj_ptr": np.cumsum([0] + [len(incS.covs) for incS in streams], dtype=np.int64),
+            "adj": np.array(adj, dtype=np.int64),
+            "cached": cached,
+            "std": std,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "evicted_covs": self.evicted_covs,
+        }
+
+    # Replaces the contents of the table with a snapshot from get_state() of this or the array store.
+    # The records' statistics are views of the snapshot arrays (which may be copy-on-write memory maps).
+    def load_state(self, state):
+        S, M, C = state["S"], state["M"], state["C"]
+        if S.shape[2] != len(self.Lambdas):
+            raise ValueError("snapshot tracks " + str(S.shape[2]) + " Lambdas, table tracks " + str(len(self.Lambdas)))
+        if self.cov_lambdas is not None:
+            C = C[:, :, self.cov_lambdas]
+        order = state["order"].tolist()
+        IDs = _decode_keys(state["keys"][order])
+        last = state["last"].tolist()
+        typediff = state["typediff"].tolist()
+        cached = state["cached"].tolist() if "cached" in state else None
+        std = state.get("std")
+
+        self.HT = OrderedDict() if self.evict else dict()
+        streams = [None] * len(state["keys"])
+        for s, ID in zip(order, IDs):
+            incS = incStatMulti(self.Lambdas, ID, last[s], typediff[s], self.scratch)
+            incS.S = S[s]
+            if cached is None:  # the array store always has mean and var
+                incS.cur_mean, incS.cur_var = M[s]
+            else:
+                c_mean, c_var, c_std = cached[s]
+                incS.cur_mean = M[s, 0] if c_mean else None
+                incS.cur_var = M[s, 1] if c_var else None
+                incS.cur_std = std[s] if c_std else None
+            self.HT[ID] = incS
+            streams[s] = incS
+
+        last3 = state["last3"].tolist()
+        covs = [None] * len(last3)
+        for c, (e0, e1) in enumerate(state["ends"].tolist()):
+            if e0 >= 0:
+                covs[c] = incStat_covMulti(streams[e0], streams[e1], last3[c], self.cov_lambdas, self.cov_scratch)
+                covs[c].R = C[c]
+        adj_ptr = state["adj_ptr"].tolist()
+        adj = state["adj"].tolist()
+        for s, incS in enumerate(streams):
+            if incS is not None:
+                incS.covs = [covs[c] for c in adj[adj_ptr[s]:adj_ptr[s + 1]]]
+
+        self.evictions = state["evictions"]
+        self.expired = state["expired"]
+        self.evicted_covs = state["evicted_covs"]
+        self.expiry_heap = []
+        self.expiry_seq = 0
+        if self.expire_weight is not None:
+            # a stream expires when it and all of its covariance trackers have decayed
+            t_exp = _expiry_times(S[:, 2], state["last"], self.Lambdas, self.expire_weight)
+            live = state["ends"][:, 0] >= 0
+            if live.any():
+                cov_Lambdas = self.Lambdas if self.cov_lambdas is None else np.asarray(self.Lambdas)[self.cov_lambdas]
+                t_cov = _expiry_times(C[live, 2], state["last3"][live], cov_Lambdas, self.expire_weight)
+                np.maximum.at(t_exp, state["ends"][live, 0], t_cov)
+                np.maximum.at(t_exp, state["ends"][live, 1], t_cov)
+            t_exp = t_exp.tolist()
+            self.expiry_heap = [(t_exp[s], i, streams[s]) for i, s in enumerate(order)]
+            heapq.heapify(self.expiry_heap)
+            self.expiry_seq = len(self.expiry_heap)
+
+    # Registers covariance tracking for two streams, registers missing streams
+    def register_cov(self, ID1, ID2, init_time=0, isTypeDiff=False):
+        # Lookup both streams
+        incS1 = self.register(ID1, init_time, isTypeDiff)
+        incS2 = self.register(ID2, init_time, isTypeDiff)
+
+        # check for pre-exiting link
+        for cov in incS1.covs:
+            if cov.incStats[0].ID == ID2 or cov.incStats[1].ID == ID2:
+                return cov  # there is a pre-exiting link
+
+        # Link incStats
+        inc_cov = incStat_covMulti(incS1, incS2, init_time, self.cov_lambdas, self.cov_scratch)
+        incS1.covs.append(inc_cov)
+        incS2.covs.append(inc_cov)
+        return inc_cov
+
+    # updates/registers stream
+    def update(self, ID, t, v, isTypeDiff=False):
+        incS = self.register(ID, t, isTypeDiff)
+        incS.insert(v, t)
+        return incS
+
+    # Updates and then pulls current 1D stats: shape (n_lambdas, 3) [weight, mean, std] per Lambda
+    # out: optional (n_lambdas, 3) array (or view, e.g. of a larger feature vector) to write them into
+    def update_get_1D_Stats(self, ID, t, v, isTypeDiff=False, out=None):
+        if out is None:
+            out = np.empty((len(self.Lambdas), 3))
+        incS = self.update(ID, t, v, isTypeDiff)
+        incS.allstats_1D(out.T)
+        return out
+
+    # Updates and then pulls current 1D and 2D stats: shape (n_lambdas, 7) per Lambda
+    # out: optional (n_lambdas, 7) array (or view) to write them into
+    def update_get_1D2D_Stats(self, ID1, ID2, t1, v1, out=None):
+        if out is None:
+            out = np.empty((len(self.Lambdas), 7))
+        self.update(ID1, t1, v1).allstats_1D(out.T[:3])
+        # retrieve/add cov tracker
+        inc_cov = self.register_cov(ID1, ID2, t1)
+        # Update cov tracker
+        inc_cov.update_cov(ID1, v1, t1)
+        inc_cov.get_stats2(out.T[3:])
+        return out
+
+    def getHeaders_1D(self, Lambda=1, ID=None):
+        return self._hdrs.getHeaders_1D(Lambda, ID)
+
+    def getHeaders_1D2D(self, Lambda=1, IDs=None, ver=1):
+        return self._hdrs.getHeaders_1D2D(Lambda, IDs, ver)
@@ -0,0 +1,49 @@
+import os
+import importlib
+
+# Registry of AfterImage implementations. Both modules provide the same incStatDB interface:
+#   "cython": the compiled AfterImage_extrapolate extension (build it in place on Linux with
+#             python setup.py build_ext --inplace; the repo ships only the Windows .pyd)
+#   "python": the pure-Python AfterImage module, always available
+# load_backend() prefers the compiled extension and falls back to pure Python, so importing never
+# triggers a compile. NTB_AFTERIMAGE_BACKEND=cython|python forces one (and fails if it can't be loaded).
+
+BACKENDS = {
+    "cython": "kitsune_core.AfterImage_extrapolate",
+    "python": "kitsune_core.AfterImage",
+}
+PREFERENCE = ["cython", "python"]
+
+
+# Returns the names of the backends that can be imported here, in order of preference
+def available_backends():
+    names = []
+    for name in PREFERENCE:
+        try:
+            importlib.import_module(BACKENDS[name])
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+# Returns the AfterImage module of the named backend (None: NTB_AFTERIMAGE_BACKEND, else the fastest available)
+def load_backend(name=None):
+    name = name or os.environ.get("NTB_AFTERIMAGE_BACKEND")
+    if name is not None:
+        if name not in BACKENDS:
+            raise ValueError("Unknown AfterImage backend '" + name + "', expected one of " + str(list(BACKENDS)))
+        return importlib.import_module(BACKENDS[name])
+    for candidate in PREFERENCE:
+        try:
+            return importlib.import_module(BACKENDS[candidate])
+        except ImportError:
+            continue
+    raise ImportError("No AfterImage backend could be imported")
+
+
+def backend_name(module):
+    for name, path in BACKENDS.items():
+        if module.__name__ == path:
+            return name
+    return module.__name__
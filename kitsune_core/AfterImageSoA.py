@@ -0,0 +1,510 @@
+import math
+from collections import OrderedDict
+import numpy as np
+from kitsune_core.AfterImage import incStatDB, _encode_key, _decode_keys, _lambda_index
+
+# Struct-of-arrays variant of AfterImage.incStatDBMulti (same interface, usable by netStat).
+# Instead of one incStatMulti object per stream and one incStat_covMulti per covariance, all statistics
+# live in preallocated NumPy arrays that grow by doubling:
+#   streams:  S[slot] = (CF1, CF2, w) x Lambdas, M[slot] = (mean, var) x Lambdas, last[slot] = lastTimestamp,
+#             typediff[slot]
+#   covs:     C[cov] = (lastRes of stream 0, CF3, w3, lastRes of stream 1) x covariance Lambdas (all of them unless
+#             set_cov_lambdas() restricts them), last3[cov], ends[cov]
+# plus a key -> slot index, a slot -> [cov ids] adjacency list and free lists for both kinds of slots.
+# Inserting into a stream decays and updates all of its covariances (and their other streams) in one
+# vectorized step, and the weight of every stream can be decayed at once for cleanup (expire, cleanOutOldRecords).
+#
+# mean and var are computed on insert and kept in M: decay scales CF1, CF2 and w alike, so they don't change
+# until the next insert (like the cached values of incStatMulti, and without recomputing them from weights that
+# have decayed towards subnormal floats). Decay factors come from np.exp2, so results match incStatDBMulti to
+# floating point rounding, not bit for bit. That holds without expire_weight only: expire() sweeps the slots
+# round-robin where incStatDBMulti pops the earliest-due stream off a heap, so the two drop dead streams in a
+# different order and at different times.
+#
+# Per-packet updates run in place on preallocated work arrays: a stream's rows directly, and a batch of
+# covariances (with their other streams) gathered into _Batch arrays, updated there and scattered back. Every
+# ufunc gets contiguous operands of one shape, since NumPy buffers strided and broadcast ones (and where=) in
+# temporaries as large as the operation; so the temporaries left are array views, index conversions and the
+# fixed-size state of the fancy-index gathers and scatters, not arrays that grow with the number of covariances.
+# (Gathers use np.take with mode="clip": the indices are valid anyway, and with the default mode="raise" take()
+# buffers out= in a temporary copy.)
+
+
+# work arrays for updating up to n covariances (with the Lambdas cov_neg_Lambdas) and their other streams (with
+# the Lambdas neg_Lambdas) at once. The field-major copies are flat, to be viewed with the shape of a batch.
+class _Batch:
+    def __init__(self, n, neg_Lambdas, cov_neg_Lambdas):
+        L, Lc = len(neg_Lambdas), len(cov_neg_Lambdas)
+        self.idx = np.empty(n, dtype=np.int64)  # cov ids
+        self.ends = np.empty((n, 2), dtype=np.int64)
+        self.ends_T = np.empty(2 * n, dtype=np.int64)  # (2, n)
+        self.hit = np.empty((n, 2), dtype=bool)
+        self.other = np.empty(n, dtype=np.int64)  # the stream at the other end
+        self.res0 = np.empty((n, 1), dtype=bool)  # the updated stream is end 0 (its residual is row 0, else 3)
+        self.res3 = np.empty((n, 1), dtype=bool)
+        self.self_cov = np.empty((n, 1), dtype=bool)
+        self.mult = np.ones((n, Lc))  # times each cov is listed (a self-covariance can be listed twice)
+        self.last = np.empty(n)
+        self.dt = np.empty(n)
+        self.S = np.empty((n, 3, L))
+        self.F = np.empty((n, 3, L))  # decay factors, tiled to the shape of S
+        self.f = np.empty((n, L))
+        self.neg_Lambdas = np.tile(neg_Lambdas, (n, 1))
+        self.C = np.empty((n, 4, Lc))
+        self.C_T = np.empty(4 * n * Lc)  # (4, n, Lc)
+        self.f3 = np.empty((n, Lc))
+        self.neg_cov_Lambdas = np.tile(cov_neg_Lambdas, (n, 1))
+        self.a = np.empty((n, Lc))
+        self.b = np.empty((n, Lc))
+
+
+class incStatDBSoA:
+    # Lambdas, limit, evict, expire_weight: as in incStatDBMulti
+    # capacity: initial number of stream and cov slots
+    def __init__(self, Lambdas, limit=np.inf, evict=False, expire_weight=None, capacity=1024):
+        self.Lambdas = tuple(Lambdas)
+        self.neg_Lambdas = -np.asarray(self.Lambdas, dtype=np.float64)
+        self.limit = limit
+        self.evict = evict
+        self.expire_weight = expire_weight
+        L = len(self.Lambdas)
+        capacity = max(int(capacity), 2)
+
+        # streams
+        self.index = OrderedDict() if evict else dict()  # key -> slot (evict: least to most recently used)
+        self.keys = [None] * capacity  # slot -> key
+        self.adj = [None] * capacity  # slot -> list of cov ids (a stream's covariance with itself appears twice)
+        self.S = np.zeros((capacity, 3, L))
+        self.M = np.zeros((capacity, 2, L))
+        self.last = np.zeros(capacity)
+        self.typediff = np.zeros(capacity, dtype=bool)
+        self.used = np.zeros(capacity, dtype=bool)
+        self.free = list(range(capacity - 1, -1, -1))
+
+        # covariances
+        self.C = np.zeros((capacity, 4, L))
+        self.last3 = np.zeros(capacity)
+        self.ends = np.full((capacity, 2), -1, dtype=np.int64)
+        self.cov_free = list(range(capacity - 1, -1, -1))
+        self.cov_lambdas = None  # the Lambdas in C (None: all; see AfterImage._lambda_index)
+        self.cov_neg_Lambdas = self.neg_Lambdas
+
+        # work arrays, so per-packet updates and stats need no temporary arrays
+        self.tmp = np.empty((2, L))
+        self.zero = np.empty(L, dtype=bool)
+        self.neg_Lambdas3 = np.tile(self.neg_Lambdas, (3, 1))
+        self.F3 = np.empty((3, L))  # decay factors of one stream, tiled to the shape of S[slot]
+        self.ins = np.ones((3, L))  # what an insert adds to S[slot]: (v, v**2, 1)
+        self.stats2 = np.empty((4, L))  # _stats2 results, copied to the caller's out in one go
+        self.stats2_rows = tuple(self.stats2)
+        self.batch = _Batch(16, self.neg_Lambdas, self.cov_neg_Lambdas)
+
+        self.sweep = 0  # next slot checked by expire()
+        self.evictions = 0  # streams evicted
+        self.expired = 0  # streams expired
+        self.evicted_covs = 0  # covariance trackers unlinked by evictions and expiry
+        self._hdrs = incStatDB(limit)  # header formatting is shared with the per-Lambda DB
+
+    # Restricts the covariances to the Lambdas with the given indices (None: all of them), so the 2D stats of the
+    # others cost nothing and are NaN. Only possible while no covariances are tracked, as C holds one width.
+    def set_cov_lambdas(self, lambdas=None):
+        index = _lambda_index(lambdas, len(self.Lambdas))
+        columns = np.arange(len(self.Lambdas))
+        if np.array_equal(columns if index is None else columns[index],
+                          columns if self.cov_lambdas is None else columns[self.cov_lambdas]):
+            return
+        if len(self.cov_free) < len(self.last3):
+            raise ValueError("the covariance Lambdas can't change while covariances are tracked")
+        self.cov_lambdas = index
+        self.cov_neg_Lambdas = self.neg_Lambdas if index is None else self.neg_Lambdas[index]
+        self.C = np.zeros((len(self.last3), 4, len(self.cov_neg_Lambdas)))
+        self.batch = _Batch(len(self.batch.idx), self.neg_Lambdas, self.cov_neg_Lambdas)
+
+    def _grow_streams(self):
+        cap = len(self.keys)
+        self.keys.extend([None] * cap)
+        self.adj.extend([None] * cap)
+        self.S = np.concatenate((self.S, np.zeros_like(self.S)))
+        self.M = np.concatenate((self.M, np.zeros_like(self.M)))
+        self.last = np.concatenate((self.last, np.zeros(cap)))
+        self.typediff = np.concatenate((self.typediff, np.zeros(cap, dtype=bool)))
+        self.used = np.concatenate((self.used, np.zeros(cap, dtype=bool)))
+        self.free.extend(range(2 * cap - 1, cap - 1, -1))
+
+    def _grow_covs(self):
+        cap = len(self.last3)
+        self.C = np.concatenate((self.C, np.zeros_like(self.C)))
+        self.last3 = np.concatenate((self.last3, np.zeros(cap)))
+        self.ends = np.concatenate((self.ends, np.full((cap, 2), -1, dtype=np.int64)))
+        self.cov_free.extend(range(2 * cap - 1, cap - 1, -1))
+
+    # Registers a new stream and returns its slot. init_time: init lastTimestamp of the stream
+    def register(self, ID, init_time=0, isTypeDiff=False):
+        s = self.index.get(ID)
+        if s is None:  # does not already exist
+            if (len(self.index) + 1) * len(self.Lambdas) > self.limit:
+                if not self.evict or not self.index:
+                    raise LookupError(
+                        'Adding Entry:\n' + str(ID) + '\nwould exceed incStatHT 1D limit of ' + str(
+                            self.limit) + '.\nObservation Rejected.')
+                self.evict_lru()
+            if not self.free:
+                self._grow_streams()
+            s = self.free.pop()
+            self.index[ID] = s
+            self.keys[s] = ID
+            self.adj[s] = []
+            self.S[s] = 0
+            self.S[s, 2] = 1e-20
+            self.M[s] = 0
+            self.last[s] = init_time
+            self.typediff[s] = isTypeDiff
+            self.used[s] = True
+        elif self.evict:
+            self.index.move_to_end(ID)
+        return s
+
+    # Registers covariance tracking for two streams (registers missing streams) and returns the cov id
+    def register_cov(self, ID1, ID2, init_time=0, isTypeDiff=False):
+        s1 = self.register(ID1, init_time, isTypeDiff)
+        s2 = self.register(ID2, init_time, isTypeDiff)
+
+        # check for pre-exiting link
+        covs = self.adj[s1]
+        if covs:
+            n = len(covs)
+            B = self._batch(n)
+            hit = np.equal(np.take(self.ends, covs, axis=0, out=B.ends[:n], mode="clip"), s2, out=B.hit[:n])
+            j = int(hit.argmax())
+            if hit.item(j):
+                return covs[j // 2]
+
+        # Link streams
+        if not self.cov_free:
+            self._grow_covs()
+        c = self.cov_free.pop()
+        self.ends[c] = (s1, s2)
+        self.C[c] = 0
+        self.C[c, 2] = 1e-20
+        self.last3[c] = init_time
+        self.adj[s1].append(c)
+        self.adj[s2].append(c)
+        return c
+
+    # the covariance work arrays, grown to hold at least n covariances
+    def _batch(self, n):
+        if n > len(self.batch.idx):
+            self.batch = _Batch(max(n, 2 * len(self.batch.idx)), self.neg_Lambdas, self.cov_neg_Lambdas)
+        return self.batch
+
+    # decays stream slot s, whose statistics are S, to time t
+    def _decay(self, s, S, t):
+        dt = t - self.last.item(s)
+        if dt > 0:
+            F = np.multiply(self.neg_Lambdas3, dt, out=self.F3)
+            np.multiply(S, np.exp2(F, out=F), out=S)
+            self.last[s] = t
+
+    # decays the stream slots (an array of n of them) to time t, using the first n rows of the batch arrays
+    def _decay_slots(self, slots, t):
+        n = len(slots)
+        B = self.batch
+        S = np.take(self.S, slots, axis=0, out=B.S[:n], mode="clip")
+        last = np.take(self.last, slots, out=B.last[:n], mode="clip")
+        dt = np.maximum(np.subtract(t, last, out=B.dt[:n]), 0, out=B.dt[:n])
+        f = B.f[:n]
+        np.copyto(f, dt[:, None])
+        np.exp2(np.multiply(f, B.neg_Lambdas[:n], out=f), out=f)
+        F = B.F[:n]
+        np.copyto(F, f[:, None, :])
+        self.S[slots] = np.multiply(S, F, out=S)
+        self.last[slots] = np.maximum(last, t, out=last)
+
+    def _insert(self, s, v, t):
+        if self.typediff[s]:
+            dif = t - self.last[s]
+            if dif > 0:
+                v = dif
+            else:
+                v = 0
+        S = self.S[s]
+        self._decay(s, S, t)
+
+        # update with v
+        ins = self.ins
+        ins[0] = v
+        ins[1] = math.pow(v, 2)
+        np.add(S, ins, out=S)
+        CF1, CF2, w = S
+        mean, var = self.M[s]
+        np.divide(CF1, w, out=mean)
+        np.divide(CF2, w, out=var)
+        np.subtract(var, np.square(mean, out=self.tmp[0]), out=var)
+        np.abs(var, out=var)
+
+        # update covs (if any)
+        if self.adj[s]:
+            self._update_covs(s, self.adj[s], v, t)
+
+    # updates the covariances covs of stream s (which has ALREADY been updated with (t,v)). They are gathered into
+    # the batch arrays, updated there and scattered back; a self-covariance listed twice gets the same update in
+    # both rows, counting it twice
+    def _update_covs(self, s, covs, v, t):
+        n = len(covs)
+        B = self._batch(n)
+        c = B.idx[:n]
+        c[:] = covs
+        ends = B.ends_T[:2 * n].reshape(2, n)
+        np.copyto(ends, np.take(self.ends, c, axis=0, out=B.ends[:n], mode="clip").T)
+        end0, end1 = ends
+        res0 = B.res0[:n]
+        np.equal(end0, s, out=res0[:, 0])  # which end of each cov produced (t,v)
+        res3 = np.logical_not(res0, out=B.res3[:n])
+        self_cov = B.self_cov[:n]
+        n_self = np.count_nonzero(np.equal(end0, end1, out=self_cov[:, 0]))
+        mult = B.mult[:n]
+        if n_self > 1:
+            np.copyto(mult, n_self, where=self_cov)
+
+        # Decay other streams
+        self._decay_slots(np.subtract(np.add(end0, end1, out=B.other[:n]), s, out=B.other[:n]), t)
+
+        # Decay residules (CF3, w3 and the producing stream's residual)
+        C = B.C_T[:4 * n * len(self.cov_neg_Lambdas)].reshape(4, n, -1)
+        np.copyto(C, np.take(self.C, c, axis=0, out=B.C[:n], mode="clip").transpose(1, 0, 2))
+        r0, CF3, w3, r3 = C
+        last3 = np.take(self.last3, c, out=B.last[:n], mode="clip")
+        dt = np.maximum(np.subtract(t, last3, out=B.dt[:n]), 0, out=B.dt[:n])
+        factor = B.f3[:n]
+        np.copyto(factor, dt[:, None])
+        np.exp2(np.multiply(factor, B.neg_cov_Lambdas[:n], out=factor), out=factor)
+        np.multiply(CF3, factor, out=CF3)
+        np.multiply(w3, factor, out=w3)
+        a = B.a[:n]
+        np.copyto(r0, np.multiply(r0, factor, out=a), where=res0)
+        np.copyto(r3, np.multiply(r3, factor, out=a), where=res3)
+        self.last3[c] = np.maximum(last3, t, out=last3)
+
+        # Compute and update residule
+        res = B.b[:n]
+        np.copyto(res, self.M[s, 0] if self.cov_lambdas is None else self.M[s, 0, self.cov_lambdas])
+        np.subtract(v, res, out=res)
+        other_res = a
+        np.copyto(other_res, r0)
+        np.copyto(other_res, r3, where=res0)
+        np.add(CF3, np.multiply(res, other_res, out=other_res), out=CF3)
+        np.add(w3, mult, out=w3)
+        np.copyto(r0, res, where=res0)
+        np.copyto(r3, res, where=res3)
+        self.C[c] = C.transpose(1, 0, 2)
+        if n_self > 1:
+            mult.fill(1)
+
+    # (3, n_lambdas) [weight, mean, var] of stream slot s
+    def _stats1D(self, s, out):
+        out[0] = self.S[s, 2]
+        out[1:] = self.M[s]
+        return out
+
+    # (4, n_lambdas) [radius, magnitude, cov, pcc] of cov c
+    def _stats2(self, c, out):
+        s0, s1 = self.ends[c]
+        if self.cov_lambdas is not None:  # only the tracked Lambdas
+            idx = self.cov_lambdas
+            (mean0, var0), (mean1, var1) = self.M[s0][:, idx], self.M[s1][:, idx]
+            out[:] = np.nan
+            out[0, idx] = np.sqrt(np.square(var0) + np.square(var1))
+            out[1, idx] = np.sqrt(np.square(mean0) + np.square(mean1))
+            cov = self.C[c, 1] / self.C[c, 2]
+            out[2, idx] = cov
+            ss = np.sqrt(var0) * np.sqrt(var1)
+            out[3, idx] = np.divide(cov, ss, out=np.zeros_like(ss), where=ss != 0)
+            return out
+        mean0, var0 = self.M[s0]
+        mean1, var1 = self.M[s1]
+        radius, magnitude, cov, pcc = self.stats2_rows
+        a, b = self.tmp
+        np.sqrt(np.add(np.square(var0, out=a), np.square(var1, out=b), out=radius), out=radius)
+        np.sqrt(np.add(np.square(mean0, out=a), np.square(mean1, out=b), out=magnitude), out=magnitude)
+        _, CF3, w3, _ = self.C[c]
+        np.divide(CF3, w3, out=cov)
+        ss = np.multiply(np.sqrt(var0, out=a), np.sqrt(var1, out=b), out=a)
+        zero = np.equal(ss, 0, out=self.zero)  # (pcc is 0 there: divide by 1 instead)
+        np.copyto(ss, 1, where=zero)
+        np.divide(cov, ss, out=pcc)
+        np.copyto(pcc, 0, where=zero)
+        out[...] = self.stats2
+        return out
+
+    # updates/registers stream, returns its slot
+    def update(self, ID, t, v, isTypeDiff=False):
+        s = self.register(ID, t, isTypeDiff)
+        self._insert(s, v, t)
+        return s
+
+    # Updates and then pulls current 1D stats: shape (n_lambdas, 3) [weight, mean, std] per Lambda
+    # out: optional (n_lambdas, 3) array (or view) to write them into
+    def update_get_1D_Stats(self, ID, t, v, isTypeDiff=False, out=None):
+        if out is None:
+            out = np.empty((len(self.Lambdas), 3))
+        self._stats1D(self.update(ID, t, v, isTypeDiff), out.T)
+        return out
+
+    # Updates and then pulls current 1D and 2D stats: shape (n_lambdas, 7) per Lambda
+    # out: optional (n_lambdas, 7) array (or view) to write them into
+    def update_get_1D2D_Stats(self, ID1, ID2, t1, v1, out=None):
+        if out is None:
+            out = np.empty((len(self.Lambdas), 7))
+        self._stats1D(self.update(ID1, t1, v1), out.T[:3])
+        # retrieve/add cov tracker
+        c = self.register_cov(ID1, ID2, t1)
+        # Update cov tracker
+        self._update_covs(self.index[ID1], [c], v1, t1)
+        self._stats2(c, out.T[3:])
+        return out
+
+    # Removes the least recently used stream
+    def evict_lru(self):
+        ID, s = self.index.popitem(last=False)
+        self._release(s)
+        self.evictions += 1
+        return ID
+
+    def _remove(self, s):
+        del self.index[self.keys[s]]
+        self._release(s)
+
+    # Unlinks a removed stream from the streams it was correlated with and frees its slots
+    def _release(self, s):
+        for c in self.adj[s]:
+            self.evicted_covs += 1
+            if self.ends[c, 0] == -1:
+                continue  # self-covariance, already freed
+            s0, s1 = self.ends[c]
+            other = s1 if s0 == s else s0
+            if other != s:
+                self.adj[other].remove(c)
+            self.ends[c] = -1
+            self.cov_free.append(c)
+        self.keys[s] = None
+        self.adj[s] = None
+        self.used[s] = False
+        self.free.append(s)
+
+    # weights (n, n_lambdas) decayed to curTime, from W as of times last (neg_Lambdas: of W's columns, default all)
+    def _decayed(self, W, last, curTime, neg_Lambdas=None):
+        neg_Lambdas = self.neg_Lambdas if neg_Lambdas is None else neg_Lambdas
+        return W * np.exp2(np.multiply.outer(np.maximum(curTime - last, 0), neg_Lambdas))
+
+    # the live slots among slots whose weight, and that of their covariance trackers, has decayed to
+    # cutoffWeight or below at every Lambda by curTime
+    def _dead(self, slots, cutoffWeight, curTime):
+        slots = slots[self.used[slots]]
+        dead = slots[(self._decayed(self.S[slots, 2], self.last[slots], curTime) <= cutoffWeight).all(axis=1)]
+        keep = []
+        for s in dead.tolist():
+            covs = self.adj[s]
+            keep.append(not covs or (self._decayed(self.C[covs, 2], self.last3[covs], curTime,
+                                                   self.cov_neg_Lambdas) <= cutoffWeight).all())
+        return dead[np.array(keep, dtype=bool)] if len(dead) else dead
+
+    # Drops up to max_purge streams whose weight has decayed below expire_weight by curTime.
+    # Each call checks the next scan slots (vectorized), sweeping the whole table round-robin over successive calls,
+    # so a dead stream is only dropped once the sweep reaches it (and if it gets a packet before then, it goes on
+    # from its decayed statistics instead of restarting).
+    def expire(self, curTime, max_purge=16, scan=None):
+        cap = len(self.keys)
+        lo = self.sweep
+        hi = min(lo + (scan or 64 * max_purge), cap)
+        self.sweep = hi if hi < cap else 0
+        dead = self._dead(np.arange(lo, hi), self.expire_weight, curTime)
+        if len(dead) > max_purge:  # resume after the last removed slot next time
+            dead = dead[:max_purge]
+            self.sweep = int(dead[-1]) + 1
+        n = 0
+        for s in dead.tolist():
+            self._remove(s)
+            n += 1
+        self.expired += n
+        return n
+
+    # removes every stream with a weight less than the cutoff in one vectorized pass. returns number or removed records.
+    def cleanOutOldRecords(self, cutoffWeight, curTime):
+        dead = self._dead(np.arange(len(self.keys)), cutoffWeight, curTime).tolist()
+        for s in dead:
+            self._remove(s)
+        return len(dead)
+
+    # IDs of the streams in the table
+    def stream_ids(self):
+        return self.index.keys()
+
+    def stats(self):
+        return {"streams": len(self.index), "evictions": self.evictions, "expired": self.expired,
+                "evicted_covs": self.evicted_covs, "covs": len(self.last3) - len(self.cov_free),
+                "stream_slots": len(self.keys), "cov_slots": len(self.last3),
+                "array_bytes": self.S.nbytes + self.M.nbytes + self.last.nbytes + self.typediff.nbytes + self.used.nbytes
+                               + self.C.nbytes + self.last3.nbytes + self.ends.nbytes}
+
+    # Copies the table into the snapshot layout of AfterImage (see _encode_key there); slots are kept as they are
+    def get_state(self):
+        order = np.fromiter(self.index.values(), dtype=np.int64, count=len(self.index))
+        keys = np.full((len(self.keys), 2), -1, dtype=np.int64)
+        if len(order):
+            keys[order] = [_encode_key(ID) for ID in self.index]
+        return {
+            "order": order, "keys": keys, "used": self.used.copy(),
+            "S": self.S.copy(), "M": self.M.copy(), "last": self.last.copy(), "typediff": self.typediff.copy(),
+            "C": self._full_width_C(), "last3": self.last3.copy(), "ends": self.ends.copy(),
+            "adj_ptr": np.cumsum([0] + [len(covs) if covs else 0 for covs in self.adj], dtype=np.int64),
+            "adj": np.array([c for covs in self.adj if covs for c in covs], dtype=np.int64),
+            "evictions": self.evictions, "expired": self.expired, "evicted_covs": self.evicted_covs,
+        }
+
+    # Copy of C at every Lambda (untracked columns hold a new covariance's values, as in AfterImage._full_width_covs)
+    def _full_width_C(self):
+        if self.cov_lambdas is None:
+            return self.C.copy()
+        C = np.zeros((len(self.C), 4, len(self.Lambdas)))
+        C[:, 2] = 1e-20
+        C[:, :, self.cov_lambdas] = self.C
+        return C
+
+    # Replaces the contents of the table with a snapshot from get_state() of this or the object store.
+    # The snapshot arrays are adopted as they are (no copy), so memory-mapped ones are paged in on demand and
+    # stay mapped for the life of the table.
+    def load_state(self, state):
+        if state["S"].shape[2] != len(self.Lambdas):
+            raise ValueError("snapshot tracks " + str(state["S"].shape[2]) + " Lambdas, table tracks "
+                             + str(len(self.Lambdas)))
+        if len(state["used"]):  # (an empty snapshot keeps the preallocated slots)
+            self.S, self.M, self.last = state["S"], state["M"], state["last"]
+            self.typediff, self.used = state["typediff"], state["used"]
+        if len(state["ends"]):
+            self.C, self.last3, self.ends = state["C"], state["last3"], state["ends"]
+            if self.cov_lambdas is not None:
+                self.C = self.C[:, :, self.cov_lambdas]
+        cap = len(self.used)
+
+        order = state["order"].tolist()
+        IDs = _decode_keys(state["keys"][order])
+        self.index = (OrderedDict if self.evict else dict)(zip(IDs, order))
+        self.keys = [None] * cap
+        for s, ID in zip(order, IDs):
+            self.keys[s] = ID
+        adj_ptr = state["adj_ptr"].tolist()
+        adj = state["adj"].tolist()
+        self.adj = [adj[lo:hi] for lo, hi in zip(adj_ptr, adj_ptr[1:])]  # (free slots get an empty list)
+        self.free = np.flatnonzero(~self.used)[::-1].tolist()
+        self.cov_free = np.flatnonzero(self.ends[:, 0] < 0)[::-1].tolist()
+
+        self.sweep = 0
+        self.evictions = state["evictions"]
+        self.expired = state["expired"]
+        self.evicted_covs = state["evicted_covs"]
+
+    def getHeaders_1D(self, Lambda=1, ID=None):
+        return self._hdrs.getHeaders_1D(Lambda, ID)
+
+    def getHeaders_1D2D(self, Lambda=1, IDs=None, ver=1):
+        return self._hdrs.getHeaders_1D2D(Lambda, IDs, ver)
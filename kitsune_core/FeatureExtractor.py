@@ -10,6 +10,7 @@ if use_extrapolation:
         subprocess.call(cmd,shell=True)
 #Import dependencies
 from kitsune_core import netStat as ns
+from kitsune_core.PacketCache import PacketCache, is_packet_cache
 import csv
 import numpy as np
 print("Importing Scapy Library")
@@ -22,14 +23,26 @@ import subprocess
 #Extracts Kitsune features from given pcap file one packet at a time using "get_next_vector()"
 # If wireshark is installed (tshark) it is used to parse (it's faster), otherwise, scapy is used (much slower).
 # If wireshark is used then a tsv file (parsed version of the pcap) will be made -which you can use as your input next time
+# A ".fecache" directory (see kitsune_core/PacketCache.py) is replayed straight from memory-mapped columns
+# tshark_pipe: read tshark's field output straight from a pipe instead of writing a tsv file (no temp file, single pass)
+# count_lines: count the rows of a tsv up front so limit reflects the packet count (costs an extra pass over the file)
+# max_streams: bound each netStat table to this many streams with LRU eviction (None: unbounded, exact Kitsune behaviour)
+TSHARK_FIELDS = ["frame.time_epoch", "frame.len", "eth.src", "eth.dst", "ip.src", "ip.dst", "tcp.srcport", "tcp.dstport",
+                 "udp.srcport", "udp.dstport", "icmp.type", "icmp.code", "arp.opcode", "arp.src.hw_mac",
+                 "arp.src.proto_ipv4", "arp.dst.hw_mac", "arp.dst.proto_ipv4", "ipv6.src", "ipv6.dst"]
+
 class FE:
-    def __init__(self,file_path,limit=np.inf):
+    def __init__(self,file_path,limit=np.inf,tshark_pipe=False,count_lines=True,max_streams=None):
         self.path = file_path
         self.limit = limit
+        self.tshark_pipe = tshark_pipe
+        self.count_lines = count_lines
         self.parse_type = None #unknown
         self.curPacketIndx = 0
         self.tsvin = None #used for parsing TSV file
         self.scapyin = None #used for parsing pcap with scapy
+        self.tshark_proc = None #used for parsing tshark output from a pipe
+        self.cachein = None #used for replaying a columnar packet cache
 
         ### Prep pcap ##
         self.__prep__()
@@ -37,7 +50,7 @@ class FE:
         ### Prep Feature extractor (AfterImage) ###
         maxHost = 100000000000
         maxSess = 100000000000
-        self.nstat = ns.netStat(np.nan, maxHost, maxSess)
+        self.nstat = ns.netStat(np.nan, maxHost, maxSess, max_streams=max_streams)
 
     def _get_tshark_path(self):
         if platform.system() == 'Windows':
@@ -51,6 +64,15 @@ class FE:
         return ''
 
     def __prep__(self):
+        ### Columnar packet cache (directory) ###
+        if is_packet_cache(self.path):
+            self.parse_type = "cache"
+            cache = PacketCache(self.path)
+            self.limit = min(self.limit, len(cache))
+            print("Replaying " + str(len(cache)) + " cached Packets.")
+            self.cachein = cache.iter_fields()
+            return
+
         ### Find file: ###
         if not os.path.isfile(self.path):  # file does not exist
             print("File: " + self.path + " does not exist")
@@ -68,8 +90,9 @@ class FE:
         elif type == "pcap" or type == 'pcapng':
             # Try parsing via tshark dll of wireshark (faster)
             if os.path.isfile(self._tshark):
-                self.pcap2tsv_with_tshark()  # creates local tsv file
-                self.path += ".tsv"
+                if not self.tshark_pipe:
+                    self.pcap2tsv_with_tshark()  # creates local tsv file
+                    self.path += ".tsv"
                 self.parse_type = "tsv"
             else: # Otherwise, parse with scapy (slower)
                 print("tshark not found. Trying scapy...")
@@ -92,29 +115,64 @@ class FE:
                     maxInt = int(maxInt / 10)
                     decrement = True
 
-            print("counting lines in file...")
-            num_lines = sum(1 for line in open(self.path))
-            print("There are " + str(num_lines) + " Packets.")
-            self.limit = min(self.limit, num_lines-1)
-            self.tsvinf = open(self.path, 'rt', encoding="utf8")
+            if self.tshark_pipe and self.path.split('.')[-1] != "tsv":
+                # rows are parsed as tshark emits them; the packet count is only known at EOF
+                print("Streaming packets from tshark...")
+                self.tshark_proc = subprocess.Popen(self._tshark_cmd(), stdout=subprocess.PIPE,
+                                                    encoding="utf8", bufsize=1 << 20)
+                self.tsvinf = self.tshark_proc.stdout
+            else:
+                if self.count_lines:
+                    print("counting lines in file...")
+                    with open(self.path, 'rb') as f:
+                        num_lines = sum(1 for line in f)
+                    print("There are " + str(num_lines) + " Packets.")
+                    self.limit = min(self.limit, num_lines-1)
+                self.tsvinf = open(self.path, 'rt', encoding="utf8")
             self.tsvin = csv.reader(self.tsvinf, delimiter='\t')
             row = self.tsvin.__next__() #move iterator past header
 
         else: # scapy
-            print("Reading PCAP file via Scapy...")
-            self.scapyin = rdpcap(self.path)
-            self.limit = len(self.scapyin)
-            print("Loaded " + str(len(self.scapyin)) + " Packets.")
+            # stream packets lazily (constant memory); the packet count is unknown until the end of the file,
+            # so get_next_vector() stops at self.limit or at EOF, whichever comes first
+            print("Streaming PCAP file via Scapy...")
+            self.scapyin = PcapReader(self.path)
 
+    # The next packet's feature vector, [] if that packet could not be processed, or None when there are no more
     def get_next_vector(self):
-        if self.curPacketIndx == self.limit:
-            if self.parse_type == 'tsv':
-                self.tsvinf.close()
+        fields = self.get_next_fields()
+        if fields is None:
+            return None
+        IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp = fields
+
+        ### Extract Features
+        try:
+            return self.nstat.updateGetStats(IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto,
+                                                 int(framelen),
+                                                 float(timestamp))
+        except Exception as e:
+            print(e)
             return []
 
+    # Parses the next packet into the netStat.updateGetStats argument tuple:
+    # (IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp), or None when done
+    def get_next_fields(self):
+        if self.curPacketIndx == self.limit:
+            self.close()
+            return None
+
         ### Parse next packet ###
-        if self.parse_type == "tsv":
-            row = self.tsvin.__next__()
+        if self.parse_type == "cache":
+            self.curPacketIndx = self.curPacketIndx + 1
+            return next(self.cachein)
+
+        elif self.parse_type == "tsv":
+            try:
+                row = self.tsvin.__next__()
+            except StopIteration:  # end of input when the row count was not known up front
+                self.limit = self.curPacketIndx
+                self.close()
+                return None
             IPtype = np.nan
             timestamp = row[0]
             framelen = row[1]
@@ -149,7 +207,12 @@ class FE:
                     dstIP = row[3]  # dst MAC
 
         elif self.parse_type == "scapy":
-            packet = self.scapyin[self.curPacketIndx]
+            try:
+                packet = next(self.scapyin)
+            except StopIteration:  # end of capture: the real packet count is now known
+                self.limit = self.curPacketIndx
+                self.close()
+                return None
             IPtype = np.nan
             timestamp = packet.time
             framelen = len(packet)
@@ -192,26 +255,32 @@ class FE:
                     srcIP = packet.src  # src MAC
                     dstIP = packet.dst  # dst MAC
         else:
-            return []
+            return None
 
         self.curPacketIndx = self.curPacketIndx + 1
+        return IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp
 
+    def close(self):
+        if self.tsvin is not None:
+            self.tsvinf.close()
+        if self.tshark_proc is not None:
+            if self.tshark_proc.poll() is None:  # stopped early (limit reached)
+                self.tshark_proc.terminate()
+            self.tshark_proc.wait()
+        if self.scapyin is not None:
+            self.scapyin.close()
 
-        ### Extract Features
-        try:
-            return self.nstat.updateGetStats(IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto,
-                                                 int(framelen),
-                                                 float(timestamp))
-        except Exception as e:
-            print(e)
-            return []
-
+    # tshark argument list (no shell): prints TSHARK_FIELDS tab-separated, one packet per line, with a header row
+    def _tshark_cmd(self):
+        cmd = [self._tshark, "-r", self.path, "-T", "fields"]
+        for field in TSHARK_FIELDS:
+            cmd += ["-e", field]
+        return cmd + ["-E", "header=y", "-E", "occurrence=f"]
 
     def pcap2tsv_with_tshark(self):
         print('Parsing with tshark...')
-        fields = "-e frame.time_epoch -e frame.len -e eth.src -e eth.dst -e ip.src -e ip.dst -e tcp.srcport -e tcp.dstport -e udp.srcport -e udp.dstport -e icmp.type -e icmp.code -e arp.opcode -e arp.src.hw_mac -e arp.src.proto_ipv4 -e arp.dst.hw_mac -e arp.dst.proto_ipv4 -e ipv6.src -e ipv6.dst"
-        cmd =  '"' + self._tshark + '" -r '+ self.path +' -T fields '+ fields +' -E header=y -E occurrence=f > '+self.path+".tsv"
-        subprocess.call(cmd,shell=True)
+        with open(self.path + ".tsv", "w", encoding="utf8") as tsv:
+            subprocess.call(self._tshark_cmd(), stdout=tsv)
         print("tshark parsing complete. File saved as: "+self.path +".tsv")
 
     def get_num_features(self):
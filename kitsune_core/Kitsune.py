@@ -34,8 +34,10 @@ class Kitsune:
     def proc_next_packet(self):
         # create feature vector
         x = self.FE.get_next_vector()
+        if x is None:
+            return -1 #no packets left
         if len(x) == 0:
-            return -1 #Error or no packets left
+            return 0 #packet could not be processed: skip it
 
         # process KitNET
         return self.AnomDetector.process(x)  # will train during the grace periods, then execute on all the rest.
@@ -0,0 +1,117 @@
+import os
+import json
+import pickle
+import shutil
+import numpy as np
+
+# Binary snapshots of netStat state (netStat.get_state()), so a restarted sniffer resumes with warm windows.
+# A snapshot is a directory holding:
+#   netstat.json           constructor arguments, next atom code and the per-table counters
+#   atoms.json             the interned [string, code] pairs, least recently seen first
+#   <table>.<array>.npy    the slot arrays of each table (MI, HH, HH_jit, HpHp; layout: see AfterImage._encode_key)
+#   extra.pkl              optional pickled extras (e.g. the LiveFeatureExtractor AfterImage layer)
+# Writes go to "<dir>.tmp" and are swapped in with renames, so a crash mid-write leaves the previous snapshot
+# (as "<dir>.old" if it came between the renames; read_snapshot falls back to it).
+# Arrays can be memory-mapped copy-on-write on load (mmap=True), which suits read-only inspection. A restored
+# table keeps the arrays it was given, though, and on Windows a directory with mapped files can neither be
+# renamed nor deleted, so state that will be snapshotted back to the same path is read into memory.
+#
+#   python -m kitsune_core.NetStatSnapshot <snapshot dir>    prints the tables of a snapshot
+
+SNAPSHOT_VERSION = 1
+
+
+def write_snapshot(state, path):
+    tmp = path.rstrip("/\\") + ".tmp"
+    if os.path.exists(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+
+    tables = {}
+    for name, table in state["tables"].items():
+        tables[name] = {}
+        for key, value in table.items():
+            if isinstance(value, np.ndarray):
+                np.save(os.path.join(tmp, name + "." + key + ".npy"), value)
+            else:
+                tables[name][key] = value
+    meta = {"version": SNAPSHOT_VERSION, "config": state["config"], "next_atom": state["next_atom"],
+            "tables": tables, "extra": "extra" in state}
+    with open(os.path.join(tmp, "netstat.json"), "w", encoding="utf8") as f:
+        json.dump(meta, f)
+    with open(os.path.join(tmp, "atoms.json"), "w", encoding="utf8") as f:
+        json.dump(state["atoms"], f)
+    if "extra" in state:
+        with open(os.path.join(tmp, "extra.pkl"), "wb") as f:
+            pickle.dump(state["extra"], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    # (if only "<dir>.old" is left from an interrupted write, it stays until the new snapshot is in place)
+    old = path.rstrip("/\\") + ".old"
+    if os.path.exists(path):
+        if os.path.exists(old):
+            shutil.rmtree(old)
+        os.rename(path, old)
+    os.rename(tmp, path)
+    if os.path.exists(old):
+        shutil.rmtree(old)
+
+
+# The directory holding the snapshot saved to path: path itself, or "<path>.old" when a write was interrupted
+# between its renames; None if there is neither
+def snapshot_dir(path):
+    for candidate in (path, path.rstrip("/\\") + ".old"):
+        if os.path.exists(os.path.join(candidate, "netstat.json")):
+            return candidate
+    return None
+
+
+def snapshot_exists(path):
+    return snapshot_dir(path) is not None
+
+
+# mmap: map the arrays copy-on-write instead of reading them (changes never reach the files)
+def read_snapshot(path, mmap=False):
+    found = snapshot_dir(path)
+    if found is None:
+        raise FileNotFoundError("No netStat snapshot at " + path)
+    path = found
+    with open(os.path.join(path, "netstat.json"), encoding="utf8") as f:
+        meta = json.load(f)
+    if meta["version"] != SNAPSHOT_VERSION:
+        raise ValueError("Unsupported netStat snapshot version " + str(meta["version"]))
+    with open(os.path.join(path, "atoms.json"), encoding="utf8") as f:
+        atoms = json.load(f)
+
+    tables = {name: dict(counters) for name, counters in meta["tables"].items()}
+    for filename in os.listdir(path):
+        if filename.endswith(".npy"):
+            name, key, _ = filename.split(".")
+            array = np.load(os.path.join(path, filename), mmap_mode='c' if mmap else None)
+            tables[name][key] = np.asarray(array)  # a plain ndarray view: np.memmap indexing is much slower
+    state = {"config": meta["config"], "atoms": atoms, "next_atom": meta["next_atom"], "tables": tables}
+    if meta["extra"]:
+        with open(os.path.join(path, "extra.pkl"), "rb") as f:
+            state["extra"] = pickle.load(f)
+    return state
+
+
+def save_snapshot(nstat, path):
+    write_snapshot(nstat.get_state(), path)
+
+
+# Returns a netStat restored from a snapshot (store: override the saved "objects"/"arrays" store)
+def load_snapshot(path, mmap=False, store=None):
+    from kitsune_core.netStat import netStat
+    return netStat.from_state(read_snapshot(path, mmap), store)
+
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        print("usage: python -m kitsune_core.NetStatSnapshot <snapshot dir>")
+        sys.exit(1)
+    state = read_snapshot(sys.argv[1], mmap=True)
+    print("config:", state["config"])
+    print("atoms:", len(state["atoms"]))
+    for name, table in state["tables"].items():
+        print(f"{name}: {len(table['order'])} streams, {int((table['ends'][:, 0] >= 0).sum())} covariances")
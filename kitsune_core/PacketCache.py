@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+from array import array
+import numpy as np
+
+# Columnar on-disk cache of the per-packet fields consumed by netStat.updateGetStats.
+# A cache is a directory "<name>.fecache" holding one .npy column per field plus a string table:
+#   timestamp.npy (float64), framelen.npy (int32), iptype.npy (int8, -1 = no IP layer),
+#   srcMAC/dstMAC/srcIP/srcproto/dstIP/dstproto.npy (int32 codes into strings.json)
+# Columns are memory-mapped on load, so repeat replays skip pcap/tsv parsing entirely.
+#
+# Build once with:  python -m kitsune_core.PacketCache <capture.pcap|.tsv> [out.fecache]
+
+CACHE_EXT = ".fecache"
+STRING_COLUMNS = ["srcMAC", "dstMAC", "srcIP", "srcproto", "dstIP", "dstproto"]
+CHUNK = 65536  # rows decoded per step when replaying
+
+
+def is_packet_cache(path):
+    return os.path.isdir(path) and path.rstrip("/\\").endswith(CACHE_EXT)
+
+
+# fields_iter yields netStat argument tuples (IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp)
+def write_packet_cache(fields_iter, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    strings = {}
+    timestamp = array('d')
+    framelen = array('i')
+    iptype = array('b')
+    codes = {name: array('i') for name in STRING_COLUMNS}
+    code_cols = [codes[name] for name in STRING_COLUMNS]
+
+    for IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, flen, ts in fields_iter:
+        timestamp.append(float(ts))
+        framelen.append(int(flen))
+        iptype.append(-1 if IPtype != IPtype else int(IPtype))  # nan -> -1
+        for col, value in zip(code_cols, (srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto)):
+            code = strings.get(value)
+            if code is None:
+                code = strings[value] = len(strings)
+            col.append(code)
+
+    np.save(os.path.join(cache_dir, "timestamp.npy"), np.frombuffer(timestamp, dtype=np.float64))
+    np.save(os.path.join(cache_dir, "framelen.npy"), np.frombuffer(framelen, dtype=np.int32))
+    np.save(os.path.join(cache_dir, "iptype.npy"), np.frombuffer(iptype, dtype=np.int8))
+    for name in STRING_COLUMNS:
+        np.save(os.path.join(cache_dir, name + ".npy"), np.frombuffer(codes[name], dtype=np.int32))
+    with open(os.path.join(cache_dir, "strings.json"), "w", encoding="utf8") as f:
+        json.dump(list(strings), f)
+    return len(timestamp)
+
+
+class PacketCache:
+    def __init__(self, cache_dir, mmap=True):
+        mode = 'r' if mmap else None
+        self.timestamp = np.load(os.path.join(cache_dir, "timestamp.npy"), mmap_mode=mode)
+        self.framelen = np.load(os.path.join(cache_dir, "framelen.npy"), mmap_mode=mode)
+        self.iptype = np.load(os.path.join(cache_dir, "iptype.npy"), mmap_mode=mode)
+        self.codes = [np.load(os.path.join(cache_dir, name + ".npy"), mmap_mode=mode) for name in STRING_COLUMNS]
+        with open(os.path.join(cache_dir, "strings.json"), encoding="utf8") as f:
+            self.strings = json.load(f)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    # Yields netStat argument tuples, starting at row start
+    def iter_fields(self, start=0):
+        strings = self.strings
+        iptypes = (0, 1, np.nan)  # indexed by code; -1 wraps to nan
+        for lo in range(start, len(self), CHUNK):
+            hi = lo + CHUNK
+            ts = self.timestamp[lo:hi].tolist()
+            flen = self.framelen[lo:hi].tolist()
+            ipt = self.iptype[lo:hi].tolist()
+            srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto = [c[lo:hi].tolist() for c in self.codes]
+            for i in range(len(ts)):
+                yield (iptypes[ipt[i]], strings[srcMAC[i]], strings[dstMAC[i]], strings[srcIP[i]],
+                       strings[srcproto[i]], strings[dstIP[i]], strings[dstproto[i]], flen[i], ts[i])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m kitsune_core.PacketCache <capture.pcap|.tsv> [out" + CACHE_EXT + "]")
+        sys.exit(1)
+    from kitsune_core.FeatureExtractor import FE
+    src = sys.argv[1]
+    out = sys.argv[2] if len(sys.argv) > 2 else src + CACHE_EXT
+    fe = FE(src, tshark_pipe=True)  # (no .tsv is written next to the capture)
+    n = write_packet_cache(iter(fe.get_next_fields, None), out)
+    print("Cached " + str(n) + " packets to " + out)
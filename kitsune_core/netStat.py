@@ -1,12 +1,17 @@
 import numpy as np
-## Prep AfterImage cython package
-import os
-import subprocess
-import pyximport
-pyximport.install()
+from collections import OrderedDict
 from kitsune_core import AfterImage as af
+from kitsune_core.AfterImageSoA import incStatDBSoA
 #import AfterImage_NDSS as af
 
+# Statistic levels of a table at one Lambda: nothing, the 1D stats (weight, mean, std) of the sending stream, or
+# those plus the 2D stats (radius, magnitude, cov, pcc) with the receiving stream, which need covariance trackers
+STAT_LEVELS = ("off", "1D", "1D2D")
+# Fewest atoms at which netStat trims its intern table (expire_weight without max_streams)
+ATOM_TRIM_MIN = 4096
+# updateGetStats output blocks, in order: (table, stats per Lambda)
+TABLE_LAYOUT = (("MI", 3), ("HH", 7), ("HH_jit", 3), ("HpHp", 7))
+
 #
 # MIT License
 #
@@ -36,24 +41,192 @@ class netStat:
     # HostLimit: no more that this many Host identifiers will be tracked
     # HostSimplexLimit: no more that this many outgoing channels from each host will be tracked (purged periodically)
     # Lambdas: a list of 'window sizes' (decay factors) to track for each stream. nan resolved to default [5,3,1,.1,.01]
-    def __init__(self, Lambdas = np.nan, HostLimit=255,HostSimplexLimit=1000):
+    # max_streams: if set, each table holds at most this many streams and evicts the least recently updated
+    # one to admit a new stream (instead of rejecting the packet), which bounds memory under scans and floods
+    # expire_weight: if set, every update also drops up to expire_batch streams per table whose weight has
+    # decayed below expire_weight at every Lambda, so idle hosts and flows don't accumulate
+    # store: "objects" (one incStatMulti object per stream) or "arrays" (AfterImageSoA: preallocated NumPy slots,
+    # far less memory per stream; equal to "objects" up to floating point rounding without expire_weight. With it
+    # the stores expire different streams at different times, so a stream one has restarted can still be decaying
+    # in the other and their outputs differ for it)
+    # profile: which statistics to compute per table and Lambda (see set_profile); None computes all of them
+    def __init__(self, Lambdas = np.nan, HostLimit=255,HostSimplexLimit=1000,max_streams=None,expire_weight=None,expire_batch=4,store="objects",profile=None):
         #Lambdas
-        if np.isnan(Lambdas):
+        if np.isscalar(Lambdas) and np.isnan(Lambdas):
             self.Lambdas = [5,3,1,.1,.01]
         else:
             self.Lambdas = Lambdas
 
         #HT Limits
         self.HostLimit = HostLimit
+        self.HostSimplexLimit = HostSimplexLimit
         self.SessionLimit = HostSimplexLimit*self.HostLimit*self.HostLimit #*2 since each dual creates 2 entries in memory
         self.MAC_HostLimit = self.HostLimit*10
 
-        #HTs
-        self.HT_jit = af.incStatDB(limit=self.HostLimit*self.HostLimit)#H-H Jitter Stats
-        self.HT_MI = af.incStatDB(limit=self.MAC_HostLimit)#MAC-IP relationships
-        self.HT_H = af.incStatDB(limit=self.HostLimit) #Source Host BW Stats
-        self.HT_Hp = af.incStatDB(limit=self.SessionLimit)#Source Host BW Stats
+        #HTs (each record tracks its stream at all Lambdas at once)
+        self.max_streams = max_streams
+        self.expire_weight = expire_weight
+        self.expire_batch = expire_batch
+        if store not in ("objects", "arrays"):
+            raise ValueError("store must be 'objects' or 'arrays'")
+        self.store = store
+        self.HT_jit = self._table(self.HostLimit*self.HostLimit)#H-H Jitter Stats
+        self.HT_MI = self._table(self.MAC_HostLimit)#MAC-IP relationships
+        self.HT_H = self._table(self.HostLimit) #Source Host BW Stats
+        self.HT_Hp = self._table(self.SessionLimit)#Source Host BW Stats
+
+        #Key interning: every MAC, IP and port string gets a compact int once; stream IDs are that int
+        #or a tuple of two (e.g. (srcMAC, srcIP)), so lookups hash ints instead of freshly concatenated
+        #strings and e.g. "1.2.3.4"+"5" can no longer collide with "1.2.3.45"+""
+        #With max_streams the atom table is bounded too: the least recently seen atom is dropped, and since codes
+        #are never reused, a returning atom simply starts new streams (its old ones age out of the tables)
+        #With expire_weight alone, atoms no stream refers to any more are dropped whenever the table has doubled
+        #since the last such trim (see _trim_atoms), so it follows the expiring tables instead of growing forever
+        self.atoms = dict() if max_streams is None else OrderedDict()
+        self.next_atom = 0
+        self._reset_atom_limit()
+
+        self.set_profile(profile)
+
+    # Sets which statistics are computed. profile maps a table (MI, HH, HH_jit, HpHp) to a STAT_LEVELS level for
+    # all Lambdas, a {Lambda: level} dict (unlisted Lambdas keep every statistic) or a list of one level per
+    # Lambda; unlisted tables keep every statistic. E.g. {"HpHp": {0.01: "1D"}}. Columns that aren't computed are
+    # NaN in the output (see computed_features()). A table no Lambda needs is not updated at all, one no Lambda
+    # needs 2D stats of keeps no covariance trackers, and otherwise the trackers only track the Lambdas with 2D
+    # stats (so {"HpHp": {0.01: "1D"}} updates HpHp covariances at the other four). That trims their arithmetic but
+    # not the per-update overhead, so it runs about as fast as the full profile; dropping a table's 2D stats
+    # altogether is what saves time. 1D stats are kept at every Lambda of an updated table, as a record updates
+    # them all at once. With the array store the covariance Lambdas can only change while a table has no
+    # covariances.
+    def set_profile(self, profile=None):
+        profile = profile or {}
+        unknown = set(profile) - set(table for table, width in TABLE_LAYOUT)
+        if unknown:
+            raise ValueError("Unknown netStat tables in profile: " + str(sorted(unknown)))
+        L = len(self.Lambdas)
+        self.profile = {}
+        self.computed = np.zeros(20*L, dtype=bool)
+        offset = 0
+        for table, width in TABLE_LAYOUT:
+            full = "1D2D" if width == 7 else "1D"
+            spec = profile.get(table, full)
+            if isinstance(spec, str):
+                levels = [spec]*L
+            elif isinstance(spec, dict):
+                if not set(spec) <= set(self.Lambdas):
+                    raise ValueError("profile of " + table + " names Lambdas not in " + str(list(self.Lambdas)))
+                levels = [spec.get(lam, full) for lam in self.Lambdas]
+            else:
+                levels = list(spec)
+                if len(levels) != L:
+                    raise ValueError("profile of " + table + " needs one level per Lambda")
+            for i, level in enumerate(levels):
+                if level not in STAT_LEVELS or STAT_LEVELS.index(level) > STAT_LEVELS.index(full):
+                    raise ValueError("level of " + table + " must be one of " + str(STAT_LEVELS[:STAT_LEVELS.index(full)+1]))
+                n = {"off": 0, "1D": 3, "1D2D": width}[level]
+                self.computed[offset+i*width:offset+i*width+n] = True
+            self.profile[table] = levels
+            offset += width*L
+        self.tracked = {table: any(level != "off" for level in levels) for table, levels in self.profile.items()}
+        self.tracked_cov = {table: "1D2D" in levels for table, levels in self.profile.items()}
+        for table, HT in (("HH", self.HT_H), ("HpHp", self.HT_Hp)):
+            HT.set_cov_lambdas([i for i, level in enumerate(self.profile[table]) if level == "1D2D"] or None)
+        self.skipped = np.flatnonzero(~self.computed)
+
+    # The smallest profile that computes the given output columns (indices into getNetStatHeaders())
+    def profile_for_features(self, features):
+        L = len(self.Lambdas)
+        profile = {table: ["off"]*L for table, width in TABLE_LAYOUT}
+        offset = 0
+        for table, width in TABLE_LAYOUT:
+            for j in features:
+                if offset <= j < offset + width*L:
+                    i, stat = divmod(j - offset, width)
+                    level = "1D" if stat < 3 else "1D2D"
+                    if STAT_LEVELS.index(level) > STAT_LEVELS.index(profile[table][i]):
+                        profile[table][i] = level
+            offset += width*L
+        return profile
+
+    # indices of the output columns the profile computes
+    def computed_features(self):
+        return np.flatnonzero(self.computed)
+
+    def _table(self, limit):
+        DB = af.incStatDBMulti if self.store == "objects" else incStatDBSoA
+        if self.max_streams is None:
+            return DB(self.Lambdas,limit=limit,expire_weight=self.expire_weight)
+        return DB(self.Lambdas,limit=min(limit,self.max_streams*len(self.Lambdas)),evict=True,
+                  expire_weight=self.expire_weight)
+
+    def intern(self, s):
+        atoms = self.atoms
+        a = atoms.get(s)
+        if a is None:
+            if self.max_streams is not None and len(atoms) >= 2*self.max_streams:
+                atoms.popitem(last=False)
+            a = atoms[s] = self.next_atom
+            self.next_atom += 1
+        elif self.max_streams is not None:
+            atoms.move_to_end(s)
+        return a
+
+    # Atom count at which _trim_atoms runs next (None: never)
+    def _reset_atom_limit(self):
+        trims = self.expire_weight is not None and self.max_streams is None
+        self.atom_limit = max(ATOM_TRIM_MIN, 2*len(self.atoms)) if trims else None
+
+    # Drops the atoms no stream ID refers to (their streams have all expired); O(streams), and since it runs
+    # once the atom count has doubled, amortized O(1) per new atom
+    def _trim_atoms(self):
+        live = set()
+        for HT in self._tables().values():
+            for ID in HT.stream_ids():
+                if isinstance(ID, tuple):
+                    live.update(ID)
+                else:
+                    live.add(ID)
+        self.atoms = {s: a for s, a in self.atoms.items() if a in live}
+        self._reset_atom_limit()
 
+    # stream counts and eviction counters of each table
+    def table_stats(self):
+        return {"MI": self.HT_MI.stats(), "HH": self.HT_H.stats(), "HH_jit": self.HT_jit.stats(), "HpHp": self.HT_Hp.stats()}
+
+    def _tables(self):
+        return {"MI": self.HT_MI, "HH": self.HT_H, "HH_jit": self.HT_jit, "HpHp": self.HT_Hp}
+
+    # Copy of the full statistics state (tables incl. covariance links, interned atoms and the constructor
+    # arguments) as plain arrays, lists and numbers; see NetStatSnapshot for saving it to disk
+    def get_state(self):
+        return {"config": {"Lambdas": list(self.Lambdas), "HostLimit": self.HostLimit,
+                           "HostSimplexLimit": self.HostSimplexLimit, "max_streams": self.max_streams,
+                           "expire_weight": self.expire_weight, "expire_batch": self.expire_batch,
+                           "store": self.store, "profile": self.profile},
+                "atoms": list(self.atoms.items()),
+                "next_atom": self.next_atom,
+                "tables": {name: HT.get_state() for name, HT in self._tables().items()}}
+
+    # Replaces the statistics with a get_state() snapshot, keeping this instance's limits and store
+    # (a snapshot of either store loads into both)
+    def load_state(self, state):
+        if list(state["config"]["Lambdas"]) != list(self.Lambdas):
+            raise ValueError("snapshot Lambdas " + str(state["config"]["Lambdas"]) + " differ from " + str(self.Lambdas))
+        for name, HT in self._tables().items():
+            HT.load_state(state["tables"][name])
+        self.atoms = (dict if self.max_streams is None else OrderedDict)(state["atoms"])
+        self.next_atom = state["next_atom"]
+        self._reset_atom_limit()
+
+    # A netStat built with the snapshot's own constructor arguments (store: override the saved one)
+    @classmethod
+    def from_state(cls, state, store=None):
+        config = dict(state["config"])
+        if store is not None:
+            config["store"] = store
+        nstat = cls(**config)
+        nstat.load_state(state)
+        return nstat
 
     def findDirection(self,IPtype,srcIP,dstIP,eth_src,eth_dst): #cpp: this is all given to you in the direction string of the instance (NO NEED FOR THIS FUNCTION)
         if IPtype==0: #is IPv4
@@ -70,39 +243,68 @@ class netStat:
 
         return src_subnet, dst_subnet
 
-    def updateGetStats(self, IPtype, srcMAC,dstMAC, srcIP, srcProtocol, dstIP, dstProtocol, datagramSize, timestamp):
+    # Returns the 20*len(Lambdas) statistics of the packet (see getNetStatHeaders(); NaN where the profile skips them).
+    # out: optional float64 vector of that length (e.g. a reused buffer or one row of a batch matrix) to write
+    # them into instead of allocating a new one; every table writes its block of it in place
+    def updateGetStats(self, IPtype, srcMAC,dstMAC, srcIP, srcProtocol, dstIP, dstProtocol, datagramSize, timestamp, out=None):
         # Host BW: Stats on the srcIP's general Sender Statistics
         # Hstat = np.zeros((3*len(self.Lambdas,)))
         # for i in range(len(self.Lambdas)):
         #     Hstat[(i*3):((i+1)*3)] = self.HT_H.update_get_1D_Stats(srcIP, timestamp, datagramSize, self.Lambdas[i])
 
+        # Each table fills an (n_lambdas, n_stats) view of its block of out, i.e. the per-Lambda layout [l0 stats, l1 stats, ...]
+        L = len(self.Lambdas)
+        if out is None:
+            out = np.empty(20*L)
+
+        #Drop a bounded number of streams that have decayed away
+        if self.expire_weight is not None:
+            for HT in (self.HT_MI, self.HT_H, self.HT_jit, self.HT_Hp):
+                HT.expire(timestamp, self.expire_batch)
+            if self.atom_limit is not None and len(self.atoms) >= self.atom_limit:  # (before this packet's atoms)
+                self._trim_atoms()
+
+        #Intern keys
+        intern = self.intern
+        srcMAC = intern(srcMAC)
+        srcIP = intern(srcIP)
+        dstIP = intern(dstIP)
+
         #MAC.IP: Stats on src MAC-IP relationships
-        MIstat =  np.zeros((3*len(self.Lambdas,)))
-        for i in range(len(self.Lambdas)):
-            MIstat[(i*3):((i+1)*3)] = self.HT_MI.update_get_1D_Stats(srcMAC+srcIP, timestamp, datagramSize, self.Lambdas[i])
+        tracked = self.tracked
+        if tracked["MI"]:
+            self.HT_MI.update_get_1D_Stats((srcMAC, srcIP), timestamp, datagramSize, out=out[:3*L].reshape(L, 3))
 
         # Host-Host BW: Stats on the dual traffic behavior between srcIP and dstIP
-        HHstat =  np.zeros((7*len(self.Lambdas,)))
-        for i in range(len(self.Lambdas)):
-            HHstat[(i*7):((i+1)*7)] = self.HT_H.update_get_1D2D_Stats(srcIP, dstIP,timestamp,datagramSize,self.Lambdas[i])
+        if tracked["HH"]:
+            HHstat = out[3*L:10*L].reshape(L, 7)
+            if self.tracked_cov["HH"]:
+                self.HT_H.update_get_1D2D_Stats(srcIP, dstIP,timestamp,datagramSize, out=HHstat)
+            else:
+                self.HT_H.update_get_1D_Stats(srcIP, timestamp, datagramSize, out=HHstat[:, :3])
 
         # Host-Host Jitter:
-        HHstat_jit =  np.zeros((3*len(self.Lambdas,)))
-        for i in range(len(self.Lambdas)):
-            HHstat_jit[(i*3):((i+1)*3)] = self.HT_jit.update_get_1D_Stats(srcIP+dstIP, timestamp, 0, self.Lambdas[i],isTypeDiff=True)
+        if tracked["HH_jit"]:
+            self.HT_jit.update_get_1D_Stats((srcIP, dstIP), timestamp, 0, isTypeDiff=True, out=out[10*L:13*L].reshape(L, 3))
 
         # Host-Host BW: Stats on the dual traffic behavior between srcIP and dstIP
-        HpHpstat =  np.zeros((7*len(self.Lambdas,)))
-        if srcProtocol == 'arp':
-            for i in range(len(self.Lambdas)):
-                HpHpstat[(i*7):((i+1)*7)] = self.HT_Hp.update_get_1D2D_Stats(srcMAC, dstMAC, timestamp, datagramSize, self.Lambdas[i])
-        else:  # some other protocol (e.g. TCP/UDP)
-            for i in range(len(self.Lambdas)):
-                HpHpstat[(i*7):((i+1)*7)] = self.HT_Hp.update_get_1D2D_Stats(srcIP + srcProtocol, dstIP + dstProtocol, timestamp, datagramSize, self.Lambdas[i])
+        if tracked["HpHp"]:
+            if srcProtocol == 'arp':
+                src, dst = srcMAC, intern(dstMAC)
+            else:  # some other protocol (e.g. TCP/UDP)
+                src, dst = (srcIP, intern(srcProtocol)), (dstIP, intern(dstProtocol))
+            HpHpstat = out[13*L:].reshape(L, 7)
+            if self.tracked_cov["HpHp"]:
+                self.HT_Hp.update_get_1D2D_Stats(src, dst, timestamp, datagramSize, out=HpHpstat)
+            else:
+                self.HT_Hp.update_get_1D_Stats(src, timestamp, datagramSize, out=HpHpstat[:, :3])
 
-        return np.concatenate((MIstat, HHstat, HHstat_jit, HpHpstat))  # concatenation of stats into one stat vector
+        if len(self.skipped):
+            out[self.skipped] = np.nan
+        return out
 
-    def getNetStatHeaders(self):
+    # computed_only: only the headers of the columns the profile computes
+    def getNetStatHeaders(self, computed_only=False):
         MIstat_headers = []
         Hstat_headers = []
         HHstat_headers = []
@@ -114,4 +316,7 @@ class netStat:
             HHstat_headers += ["HH_"+h for h in self.HT_H.getHeaders_1D2D(Lambda=self.Lambdas[i],IDs=None,ver=2)]
             HHjitstat_headers += ["HH_jit_"+h for h in self.HT_jit.getHeaders_1D(Lambda=self.Lambdas[i],ID=None)]
             HpHpstat_headers += ["HpHp_" + h for h in self.HT_Hp.getHeaders_1D2D(Lambda=self.Lambdas[i], IDs=None, ver=2)]
-        return MIstat_headers + Hstat_headers + HHstat_headers + HHjitstat_headers + HpHpstat_headers
+        headers = MIstat_headers + Hstat_headers + HHstat_headers + HHjitstat_headers + HpHpstat_headers
+        if computed_only:
+            return [h for h, computed in zip(headers, self.computed) if computed]
+        return headers
@@ -1,10 +1,15 @@
 import os
 import csv
 import logging
-from time import time
-from scapy.all import sniff, IP, TCP, UDP
-from my_feature_extractor import LiveFeatureExtractor
-from voting_system import is_packet_malicious
+import numpy as np
+from time import time, sleep
+from scapy.all import AsyncSniffer, IP, TCP, UDP
+from my_feature_extractor import LiveFeatureExtractor, packet_fields
+from raw_capture import RawCapture, parse_frame, ipv4_summary
+from sniffer_pipeline import SnifferPipeline, LoadShedder, Checkpointer
+from kitsune_core.NetStatSnapshot import write_snapshot, snapshot_exists
+from sharded_extractor import ShardedFeatureExtractor, default_workers
+from voting_system import classify_batch, required_feature_indices, registry
 import sys
 import signal
 from scapy.utils import PcapWriter
@@ -14,6 +19,37 @@ LOG_DIR = "logs"
 LOG_TXT_FILE = os.path.join(LOG_DIR, "malicious_packets.log")
 LOG_CSV_FILE = os.path.join(LOG_DIR, "malicious_packets_data.csv")
 FILTER = "tcp port 80 or tcp port 443 or port 22 or port 53 or port 3389 or udp port 1900 or udp port 47808"
+CAPTURE_MODE = os.environ.get("NTB_CAPTURE_MODE", "scapy")  # "scapy" (dissect every packet) or "raw" (struct parser, no dissection)
+
+# Pipeline stages: capture -> features -> inference -> log, each behind a bounded queue
+QUEUE_DEPTHS = {"features": 10000, "inference": 10000, "log": 1000}
+DROP_POLICIES = {"features": "drop_oldest", "inference": "drop_oldest", "log": "block"}
+STATS_INTERVAL = 30  # seconds between queue/drop counter reports
+# Inference micro-batching: packets are voted on in batches of up to INFERENCE_BATCH, waiting at most
+# INFERENCE_WAIT seconds for a batch to fill (one predict call per model per batch instead of per packet;
+# benchmark_voting.py reports throughput and latency per window). INFERENCE_BATCH = 1 votes packet by packet.
+INFERENCE_BATCH = 64
+INFERENCE_WAIT = 0.005
+# Short-circuit voting: models run cheapest/most decisive first and stop once a packet's verdict and attack
+# type are fixed (same verdicts). While load shedding is active the attack type is not pinned down either,
+# so overloaded alerts name the most likely attack among the models that ran.
+SHORT_CIRCUIT = True
+FEATURE_WORKERS = int(os.environ.get("NTB_FEATURE_WORKERS", "1"))  # >1: flow-sharded extractor processes, 0: one per core
+
+# Overload mode: past these thresholds every packet still updates netStat, but only a per-flow
+# stratified sample gets the full feature vector and a vote
+SHED_QUEUE_DEPTH = 5000  # inference queue depth
+SHED_LATENCY = 0.5  # seconds from capture to feature extraction
+SHED_MIN_RATE = 0.02  # lowest fraction of packets sent to the models
+
+# Warm restart: the extractor statistics are snapshotted to STATE_DIR every CHECKPOINT_INTERVAL seconds
+# (0: only on shutdown) and restored on start, so a restart doesn't hand the models cold-start features.
+# Snapshots work with either netStat store. NTB_NETSTAT_STORE=arrays selects the struct-of-arrays store, which
+# holds far less memory per stream, but expires idle streams in sweep order rather than the objects store's heap
+# order, so its features drift from the objects store once streams expire.
+STATE_DIR = os.environ.get("NTB_STATE_DIR", os.path.join(LOG_DIR, "state"))
+CHECKPOINT_INTERVAL = 60
+NETSTAT_STORE = os.environ.get("NTB_NETSTAT_STORE", "objects")
 
 # --- SETUP ---
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -24,7 +60,27 @@ logging.basicConfig(
 )
 
 # --- INIT ---
-extractor = LiveFeatureExtractor()
+# only the features the models read are computed
+extractor_kwargs = {"required_features": required_feature_indices(), "store": NETSTAT_STORE}
+STATE_PATH = os.path.join(STATE_DIR, "extractor")
+if FEATURE_WORKERS == 1:
+    extractor = LiveFeatureExtractor(**extractor_kwargs)
+    sharded = None
+    if snapshot_exists(STATE_PATH):
+        try:
+            start = time()
+            extractor.load_state(STATE_PATH)
+            print(f"♻️ Restored netStat state from {STATE_PATH} in {time() - start:.3f}s: {extractor.nstat.table_stats()}")
+        except Exception as e:
+            print(f"⚠️ Could not restore {STATE_PATH}, starting cold:", e)
+    checkpointer = Checkpointer(extractor.snapshot_state, lambda state: write_snapshot(state, STATE_PATH),
+                                CHECKPOINT_INTERVAL)
+else:
+    extractor = None
+    checkpointer = None
+    sharded = ShardedFeatureExtractor(n_workers=FEATURE_WORKERS or default_workers(),
+                                      extractor_kwargs=extractor_kwargs, state_dir=STATE_DIR,
+                                      checkpoint_interval=CHECKPOINT_INTERVAL)
 
 # --- Ensure CSV Header ---
 if not os.path.exists(LOG_CSV_FILE):
@@ -32,35 +88,121 @@ if not os.path.exists(LOG_CSV_FILE):
         writer = csv.writer(file)
         writer.writerow(["timestamp", "src_ip", "dst_ip", "protocol", "attack_type"])
 
-# --- Packet Callback ---
-def process_packet(pkt):
-    try:
-        ts = time()
-        features = extractor.process_packet(pkt, ts)
-        if features is None:
-            return
+# --- Pipeline Stages ---
+# (src_ip, dst_ip, protocol) for the detection log, from a raw frame, a scapy packet or a precomputed tuple
+def describe(data):
+    if isinstance(data, tuple):
+        return data
+    if isinstance(data, (bytes, bytearray)):
+        return ipv4_summary(data) or ("N/A", "N/A", "N/A")
+    if IP in data:
+        return data[IP].src, data[IP].dst, data.proto
+    return "N/A", "N/A", "N/A"
+
+# features: (packet or raw frame, ts) -> (packet or raw frame, ts, features)
+def extract_features(item):
+    data, ts = item
+    fields = parse_frame(data, ts) if CAPTURE_MODE == "raw" else packet_fields(data, ts)
+    now = time()
+    full = shedder.admit(fields, pipeline.inference_stage.queue.qsize(), now - ts, now)
+    if sharded is not None:
+        # results come back through on_sharded_features(); scapy packets are summarised here
+        # so only plain tuples/bytes cross the process boundary
+        sharded.submit(fields, data if CAPTURE_MODE == "raw" else describe(data), full)
+        return None
+    with checkpointer.lock:  # (a checkpoint copies the statistics in between packets)
+        if not full:
+            extractor.update_only(fields)
+            return None
+        features = extractor.process_fields(fields)
+    if features is None:
+        return None
+    return data, ts, features
 
-        is_malicious, attack_type = is_packet_malicious(features, verbose=False)
-        if is_malicious:
-            logging.info(f"Detected {attack_type} [Live]")
-            src_ip = pkt[IP].src if IP in pkt else "N/A"
-            dst_ip = pkt[IP].dst if IP in pkt else "N/A"
-            protocol = pkt.proto if IP in pkt else "N/A"
+def on_sharded_features(tag, ts, features):
+    pipeline.inference_stage.submit((tag, ts, features))
 
-            with open(LOG_CSV_FILE, mode='a', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow([ts, src_ip, dst_ip, protocol, attack_type])
+# inference: micro-batch of items -> detection row for the log writer, or None if benign, per item
+def classify(items):
+    verdicts = classify_batch(np.stack([features for _, _, features in items]), verbose=False,
+                              attribution=shedder.rate == 1.0)
+    detections = []
+    for (data, ts, _), (is_malicious, attack_type) in zip(items, verdicts):
+        if not is_malicious:
+            detections.append(None)
+            continue
+        src_ip, dst_ip, protocol = describe(data)
+        detections.append((ts, src_ip, dst_ip, protocol, attack_type))
+    return detections
 
-    except Exception as e:
-        print("❌ Error processing packet:", e)
+# log writer
+def log_detection(detection):
+    ts, src_ip, dst_ip, protocol, attack_type = detection
+    logging.info(f"Detected {attack_type} [Live]")
+    with open(LOG_CSV_FILE, mode='a', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([ts, src_ip, dst_ip, protocol, attack_type])
+
+pipeline = SnifferPipeline(extract_features, classify, log_detection,
+                           depths=QUEUE_DEPTHS, drop_policies=DROP_POLICIES,
+                           inference_batch=INFERENCE_BATCH, inference_wait=INFERENCE_WAIT)
+shedder = LoadShedder(SHED_QUEUE_DEPTH, SHED_LATENCY, SHED_MIN_RATE)
+registry.short_circuit = SHORT_CIRCUIT
+
+def print_stats():
+    print(pipeline.format_stats())
+    s = shedder.stats()
+    print(f"📉 load shedding: sample rate={s['rate']:.3f} admitted={s['admitted']} shed={s['shed']} "
+          f"overload episodes={s['overload_episodes']}")
+    if registry.short_circuit:
+        print(registry.format_vote_stats())
+    if sharded is not None:
+        print(f"📊 sharded features: {sharded.stats()}")
+    else:
+        print(f"🗃️ netStat tables: {extractor.nstat.table_stats()}")
+        print(f"💾 checkpoints: {checkpointer.stats()}")
 
 def graceful_shutdown(signum, frame):
     print("\n🛑 Shutting down live sniffer.")
+    print_stats()
+    if checkpointer is not None:
+        checkpointer.stop()
+        try:
+            checkpointer.checkpoint()
+            print(f"💾 Saved netStat state to {STATE_PATH}")
+        except Exception as e:
+            print("❌ Could not save netStat state:", e)
+    if sharded is not None:
+        sharded.checkpoint()
+        sharded.stop()
     sys.exit(0)
-    
-signal.signal(signal.SIGTERM, graceful_shutdown)
 
 
 # --- Start Sniffing ---
-print("🚦 Monitoring live traffic...")
-sniff(filter=FILTER, prn=process_packet, store=0)
+# guarded so extractor worker processes, which are spawned and re-import this module, don't start sniffing themselves
+if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, graceful_shutdown)
+    print(f"🚦 Monitoring live traffic ({CAPTURE_MODE} capture)...")
+    if extractor is not None:
+        computed = extractor.nstat.getNetStatHeaders(computed_only=True)
+        print(f"🧮 netStat computes {len(computed)}/{len(extractor.nstat.getNetStatHeaders())} base features")
+    registry.load()  # (lazy by default: extractor worker processes import this module without loading models)
+    print(registry.format_load_times())
+    if sharded is not None:
+        print(f"🧩 Feature extraction sharded over {sharded.n_workers} processes")
+        sharded.start(on_sharded_features)
+    pipeline.start()
+    if checkpointer is not None:
+        checkpointer.start()
+    if CAPTURE_MODE == "raw":
+        pipeline.capture(RawCapture(bpf_filter=FILTER))
+    else:
+        sniffer = AsyncSniffer(filter=FILTER, prn=lambda pkt: pipeline.submit((pkt, time())), store=0)
+        sniffer.start()
+
+    try:
+        while True:
+            sleep(STATS_INTERVAL)
+            print_stats()
+    except KeyboardInterrupt:
+        graceful_shutdown(None, None)
@@ -1,66 +1,170 @@
+import pickle
 from kitsune_core import netStat as ns
-from kitsune_core import AfterImage_extrapolate as afterimage
+from kitsune_core.NetStatSnapshot import write_snapshot, read_snapshot
+from kitsune_core.AfterImageBackend import load_backend
 import numpy as np
 from scapy.all import IP, IPv6, TCP, UDP, ARP, ICMP
-LAMBDA_VALUES = [5, 3, 1, 0.1, 0.01] 
+from feature_schema import LAMBDA_VALUES, N_BASE_FEATURES, N_FEATURES, FeatureSchema, afterimage_column
+afterimage = load_backend()  # compiled AfterImage_extrapolate if built, else pure-Python AfterImage
+
+# Structured array layout accepted by LiveFeatureExtractor.process_batch (IPtype is NaN for non-IP packets)
+PACKET_DTYPE = np.dtype([
+    ("IPtype", np.float64), ("srcMAC", "U17"), ("dstMAC", "U17"), ("srcIP", "U39"), ("srcproto", "U5"),
+    ("dstIP", "U39"), ("dstproto", "U5"), ("framelen", np.int32), ("timestamp", np.float64),
+])
+
+
+# Pulls the fields netStat needs out of a dissected scapy packet
+def packet_fields(packet, timestamp):
+    IPtype = np.nan
+    framelen = len(packet)
+    srcIP, dstIP = '', ''
+    srcproto, dstproto = '', ''
+    srcMAC = getattr(packet, 'src', '')
+    dstMAC = getattr(packet, 'dst', '')
+
+    if packet.haslayer(IP):
+        srcIP = packet[IP].src
+        dstIP = packet[IP].dst
+        IPtype = 0
+    elif packet.haslayer(IPv6):
+        srcIP = packet[IPv6].src
+        dstIP = packet[IPv6].dst
+        IPtype = 1
+
+    if packet.haslayer(TCP):
+        srcproto = str(packet[TCP].sport)
+        dstproto = str(packet[TCP].dport)
+    elif packet.haslayer(UDP):
+        srcproto = str(packet[UDP].sport)
+        dstproto = str(packet[UDP].dport)
+    elif packet.haslayer(ARP):
+        srcproto = dstproto = 'arp'
+        srcIP = packet[ARP].psrc
+        dstIP = packet[ARP].pdst
+        IPtype = 0
+    elif packet.haslayer(ICMP):
+        srcproto = dstproto = 'icmp'
+        IPtype = 0
+
+    return IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp
 
 
 class LiveFeatureExtractor:
-    def __init__(self, max_hosts=1000000, max_sessions=1000000, lambda_val=np.nan):
-        self.nstat = ns.netStat(lambda_val, max_hosts, max_sessions)
+    # required_features: output columns the consumer reads (e.g. voting_system.required_feature_indices()).
+    # Only the AfterImage streams behind those columns are maintained; the other expansion columns are NaN.
+    # None computes the full vector.
+    # max_streams: memory budget of each netStat table; past it the least recently updated stream is evicted
+    # (see netStat.table_stats() for the counters). None keeps the old reject-when-full behaviour.
+    # expire_weight: streams idle long enough to decay below this weight at every lambda are dropped a few
+    # per packet, so a long-running sniffer settles at a steady-state footprint. None keeps them forever.
+    # store: netStat table store, "objects" or "arrays" (half the memory, and snapshots restore several times
+    # faster since the arrays are memory-mapped as they are; see netStat)
+    def __init__(self, max_hosts=1000000, max_sessions=1000000, lambda_val=np.nan, required_features=None,
+                 max_streams=100000, expire_weight=0.01, store="objects"):
+        self.nstat = ns.netStat(lambda_val, max_hosts, max_sessions, max_streams=max_streams,
+                                expire_weight=expire_weight, store=store)
         self.afterimage = afterimage.incStatDB(limit=1000000, default_lambda=lambda_val)
+        self.scratch = np.empty(N_BASE_FEATURES)  # netStat output discarded by update_only()
+        self.schema = FeatureSchema.from_netstat(self.nstat)  # names of the output columns
+        required = None if required_features is None else set(required_features)
+
+        # (base feature index, stream ID, lambda, first output column) of every maintained AfterImage stream
+        self.streams = []
+        for i in range(N_BASE_FEATURES):
+            for j, lam in enumerate(LAMBDA_VALUES):
+                col = afterimage_column(i, j)
+                if required is None or not required.isdisjoint(range(col, col + 3)):
+                    self.streams.append((i, str(i), lam, col))
+
+        # netStat only computes the base features that are read directly or feed a maintained stream
+        if required is not None:
+            base = {c for c in required if c < N_BASE_FEATURES} | {i for i, _, _, _ in self.streams}
+            self.nstat.set_profile(self.nstat.profile_for_features(base))
 
     def process_packet(self, packet, timestamp):
         try:
-            IPtype = np.nan
-            framelen = len(packet)
-            srcIP, dstIP = '', ''
-            srcproto, dstproto = '', ''
-            srcMAC = getattr(packet, 'src', '')
-            dstMAC = getattr(packet, 'dst', '')
-
-            if packet.haslayer(IP):
-                srcIP = packet[IP].src
-                dstIP = packet[IP].dst
-                IPtype = 0
-            elif packet.haslayer(IPv6):
-                srcIP = packet[IPv6].src
-                dstIP = packet[IPv6].dst
-                IPtype = 1
-
-            if packet.haslayer(TCP):
-                srcproto = str(packet[TCP].sport)
-                dstproto = str(packet[TCP].dport)
-            elif packet.haslayer(UDP):
-                srcproto = str(packet[UDP].sport)
-                dstproto = str(packet[UDP].dport)
-            elif packet.haslayer(ARP):
-                srcproto = dstproto = 'arp'
-                srcIP = packet[ARP].psrc
-                dstIP = packet[ARP].pdst
-                IPtype = 0
-            elif packet.haslayer(ICMP):
-                srcproto = dstproto = 'icmp'
-                IPtype = 0
-
-            # Get 100 base features
-            base_features = self.nstat.updateGetStats(
-                IPtype, srcMAC, dstMAC, srcIP, srcproto,
-                dstIP, dstproto, int(framelen), float(timestamp)
+            fields = packet_fields(packet, timestamp)
+        except Exception as e:
+            print("Feature extraction error:", e)
+            return None
+        return self.process_fields(fields)
+
+    # fields: the (IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp)
+    # tuple from packet_fields() or raw_capture.parse_frame()
+    def process_fields(self, fields):
+        features = np.full(N_FEATURES, np.nan)
+        try:
+            self._extract_into(fields, features)
+            return features
+        except Exception as e:
+            print("Feature extraction error:", e)
+            return None
+
+    # Processes packets in order and returns an (N, N_FEATURES) matrix; row k is what process_fields()
+    # returns for packet k. packets: a PACKET_DTYPE structured array, or the nine fields as parallel
+    # arrays/lists (IPtype, srcMAC, ..., timestamp). Rows of packets that fail to extract are all NaN.
+    # out: optional preallocated (N, N_FEATURES) float64 matrix to fill
+    def process_batch(self, packets, out=None):
+        if isinstance(packets, np.ndarray) and packets.dtype.names:
+            rows = packets[list(PACKET_DTYPE.names)].tolist()
+        else:
+            rows = list(zip(*[c.tolist() if isinstance(c, np.ndarray) else c for c in packets]))
+        if out is None:
+            out = np.empty((len(rows), N_FEATURES))
+        out.fill(np.nan)
+        for k, fields in enumerate(rows):
+            try:
+                self._extract_into(fields, out[k])
+            except Exception as e:
+                print("Feature extraction error:", e)
+                out[k] = np.nan
+        return out
+
+    # Updates the statistics with one packet and writes its feature vector into features (NaN-filled)
+    def _extract_into(self, fields, features):
+        IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp = fields
+
+        # Get 100 base features (written straight into the head of the output vector)
+        base_features = self.nstat.updateGetStats(
+            IPtype, srcMAC, dstMAC, srcIP, srcproto,
+            dstIP, dstproto, int(framelen), float(timestamp), out=features[:N_BASE_FEATURES]
+        )
+
+        # Calculate 3 stats per feature (weight, mean, std) for the base features (300) over 5 lambdas (1500)
+        for i, feature_id, lam, col in self.streams:
+            features[col:col + 3] = self.afterimage.update_get_1D_Stats(
+                feature_id, timestamp, base_features[i], lam
             )
 
-            # Calculate 3 stats per feature (weight, mean, std) for all base features (300) over 5 lambdas (1500)
-            afterimage_features = []
-            for i, val in enumerate(base_features):
-                feature_id = str(i)
-                for lam in LAMBDA_VALUES:
-                    stats = self.afterimage.update_get_1D_Stats(
-                        feature_id, timestamp, val, lam
-                    )
-                    afterimage_features.extend(stats)
-            return np.concatenate((base_features, afterimage_features))
+    # Copy of the statistics (netStat tables and the AfterImage expansion layer) for save_state(); the copy
+    # is taken synchronously, so it can be written out by another thread while extraction goes on
+    def snapshot_state(self):
+        state = self.nstat.get_state()
+        state["extra"] = {"afterimage": pickle.dumps(self.afterimage, protocol=pickle.HIGHEST_PROTOCOL)}
+        return state
+
+    # Saves the statistics to a snapshot directory (see kitsune_core.NetStatSnapshot)
+    def save_state(self, path):
+        write_snapshot(self.snapshot_state(), path)
 
+    # Resumes from a save_state() snapshot; this extractor's limits and store are kept.
+    # Streams decay over the downtime on their next packet, as after any idle period.
+    # (mmap=True would leave the snapshot files mapped, which blocks the next save_state() to path on Windows)
+    def load_state(self, path, mmap=False):
+        state = read_snapshot(path, mmap)
+        afterimage_layer = pickle.loads(state["extra"]["afterimage"])  # (before anything is replaced)
+        self.nstat.load_state(state)
+        self.afterimage = afterimage_layer
 
+    # Cheap path used when load is shed: keeps the netStat host/flow statistics current for this
+    # packet but skips the AfterImage expansion and the output vector
+    def update_only(self, fields):
+        try:
+            IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp = fields
+            self.nstat.updateGetStats(
+                IPtype, srcMAC, dstMAC, srcIP, srcproto,
+                dstIP, dstproto, int(framelen), float(timestamp), out=self.scratch
+            )
         except Exception as e:
             print("Feature extraction error:", e)
-            return None
@@ -0,0 +1,149 @@
+import os
+import json
+import numpy as np
+from feature_schema import ColumnSelection
+
+# Pure-NumPy forward pass of the voting ensemble (no TensorFlow at runtime).
+# The Dense weights are read from the .h5 files with h5py once and cached in models/ensemble_numpy.npz
+# together with the input columns; the cache is rebuilt when any model, scaler or top15features.csv is newer.
+# Each scaler is folded into its model's first layer (x @ (W / scale) + (b - (mean / scale) @ W)), so a batch
+# costs one column gather (a view when the columns are contiguous) and one matmul per model and layer.
+# Everything is computed in float64: the probabilities agree with Keras (float32) to about 1e-5, not bit for
+# bit, so a verdict can differ when a probability lies within that distance of a voting threshold.
+# Parity with Keras and latency: python verify_numpy_ensemble.py
+
+NUMPY_CACHE_FILE = "ensemble_numpy.npz"
+
+
+def _relu(x):
+    return np.maximum(x, 0, out=x)
+
+
+def _sigmoid(x):
+    with np.errstate(over="ignore"):  # exp(-x) -> inf gives 0 as it should
+        return 1 / (1 + np.exp(-x))
+
+
+ACTIVATIONS = {"relu": _relu, "sigmoid": _sigmoid, "tanh": np.tanh, "linear": lambda x: x}
+
+
+# [(kernel, bias, activation)] of a Sequential of Dense layers saved by model.save("*.h5")
+def read_h5_dense_layers(path):
+    import h5py
+    with h5py.File(path, "r") as f:
+        config = json.loads(f.attrs["model_config"])
+        weights = f["model_weights"]
+        layers = []
+        for layer in config["config"]["layers"]:
+            if layer["class_name"] == "InputLayer":
+                continue
+            if layer["class_name"] != "Dense" or layer["config"]["activation"] not in ACTIVATIONS:
+                raise ValueError(f"{path}: only Dense layers with {sorted(ACTIVATIONS)} activations are supported, "
+                                 f"got {layer['class_name']} {layer['config'].get('activation')}")
+            group = weights[layer["config"]["name"]]
+            arrays = {}
+            for name in group.attrs["weight_names"]:
+                name = name.decode() if isinstance(name, bytes) else name
+                arrays[name.rsplit("/", 1)[-1].split(":")[0]] = np.asarray(group[name], dtype=np.float64)
+            kernel = arrays["kernel"]
+            bias = arrays.get("bias", np.zeros(kernel.shape[1]))
+            layers.append((kernel, bias, layer["config"]["activation"]))
+    return layers
+
+
+# Files an export of the models in model_dir is built from
+def model_sources(model_dir, model_files, features_csv):
+    paths = [os.path.join(model_dir, mf) for mf in model_files]
+    paths += [os.path.join(model_dir, f"scaler_{mf.replace('model_', '').replace('.h5', '')}.pkl")
+              for mf in model_files]
+    return paths + [features_csv]
+
+
+# True if the cache exists, covers exactly model_files and is newer than all of them
+def is_current(model_dir, model_files, features_csv):
+    path = os.path.join(model_dir, NUMPY_CACHE_FILE)
+    if not os.path.exists(path):
+        return False
+    with np.load(path) as cache:
+        if sorted(cache["model_files"].tolist()) != sorted(model_files):
+            return False
+    exported = os.path.getmtime(path)
+    return all(os.path.getmtime(p) <= exported
+               for p in model_sources(model_dir, model_files, features_csv) if os.path.exists(p))
+
+
+class NumpyEnsemble:
+    # model_files: head order; columns: feature vector columns of the input matrix
+    # positions: per head, the input matrix columns it reads
+    # layers: per head, [(kernel, bias, activation)] with the scaler folded into the first layer
+    def __init__(self, model_files, columns, positions, layers):
+        self.model_files = list(model_files)
+        self.columns = np.asarray(columns, dtype=np.intp)
+        self.inputs = [ColumnSelection(p) for p in positions]
+        self.layers = layers
+
+    # heads: (model file, feature vector columns, scaler, h5 path) per ensemble member
+    @classmethod
+    def from_models(cls, heads):
+        columns = sorted(set(c for _, head_columns, _, _ in heads for c in head_columns))
+        position = {c: i for i, c in enumerate(columns)}
+        positions, layers = [], []
+        for _, head_columns, scaler, path in heads:
+            (kernel, bias, activation), *rest = read_h5_dense_layers(path)
+            mean = scaler.mean_ if scaler.with_mean else np.zeros(len(head_columns))
+            scale = scaler.scale_ if scaler.with_std else np.ones(len(head_columns))
+            positions.append([position[c] for c in head_columns])
+            layers.append([(kernel / scale[:, None], bias - (mean / scale) @ kernel, activation)] + rest)
+        return cls([mf for mf, _, _, _ in heads], columns, positions, layers)
+
+    def save(self, path):
+        arrays = {"model_files": np.array(self.model_files), "columns": self.columns}
+        for k, (selection, head_layers) in enumerate(zip(self.inputs, self.layers)):
+            arrays[f"positions_{k}"] = selection.columns
+            for l, (kernel, bias, activation) in enumerate(head_layers):
+                arrays[f"kernel_{k}_{l}"] = kernel
+                arrays[f"bias_{k}_{l}"] = bias
+                arrays[f"activation_{k}_{l}"] = np.array(activation)
+        # (written to a temporary file and renamed, so a concurrent load never sees a partial cache)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as cache:
+            heads = range(len(cache["model_files"]))
+            depth = [sum(1 for key in cache.files if key.startswith(f"kernel_{k}_")) for k in heads]
+            layers = [[(cache[f"kernel_{k}_{l}"], cache[f"bias_{k}_{l}"], str(cache[f"activation_{k}_{l}"]))
+                       for l in range(depth[k])] for k in heads]
+            return cls(cache["model_files"].tolist(), cache["columns"], [cache[f"positions_{k}"] for k in heads],
+                       layers)
+
+    # X: (N, len(columns)) matrix of the input columns; returns the (heads, N) probabilities, rounded to
+    # float32 like the Keras outputs (so saturated heads tie at exactly 1.0 there too)
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return np.stack([self.predict_head(k, X) for k in range(len(self.layers))])
+
+    # The (N,) probabilities of head k alone
+    def predict_head(self, k, X):
+        h = self.inputs[k].take(np.asarray(X, dtype=np.float64))
+        for kernel, bias, activation in self.layers[k]:
+            h = h @ kernel
+            h += bias
+            h = ACTIVATIONS[activation](h)
+        return h[:, 0].astype(np.float32)
+
+
+# Loads the cached ensemble, rebuilding the cache first if it is missing or stale.
+# heads: as for NumpyEnsemble.from_models; features_csv: the feature ID list the head columns come from.
+# The probabilities come in the order of the returned ensemble's model_files, which is the cached order if
+# the cache was current.
+def load_cached(model_dir, heads, features_csv):
+    path = os.path.join(model_dir, NUMPY_CACHE_FILE)
+    model_files = [mf for mf, _, _, _ in heads]
+    if is_current(model_dir, model_files, features_csv):
+        return NumpyEnsemble.load(path)
+    ensemble = NumpyEnsemble.from_models(heads)
+    ensemble.save(path)
+    return ensemble
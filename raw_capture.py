@@ -0,0 +1,154 @@
+import socket
+import struct
+from time import time
+import numpy as np
+from scapy.all import conf, MTU
+from scapy.utils import RawPcapReader
+
+# Raw-bytes capture path: frames are read straight from the capture socket (AF_PACKET on Linux,
+# libpcap/Npcap elsewhere) and only the fields netStat needs are pulled out with struct.
+# No scapy dissection happens per packet.
+
+ETH_P_IP = 0x0800
+ETH_P_ARP = 0x0806
+ETH_P_IPV6 = 0x86DD
+ETH_P_VLAN = (0x8100, 0x88A8)
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPV6_EXT_HEADERS = (0, 43, 60)  # hop-by-hop, routing, destination options
+IPV6_FRAGMENT = 44
+
+_ethertype = struct.Struct("!H")
+_ports = struct.Struct("!HH")
+
+
+# Walks Ethernet + 802.1Q/802.1ad tags. Returns (ethertype, offset of the L3 header)
+def _l3_offset(frame):
+    if len(frame) < 14:
+        return None, 0
+    eth_type = _ethertype.unpack_from(frame, 12)[0]
+    offset = 14
+    while eth_type in ETH_P_VLAN and len(frame) >= offset + 4:
+        eth_type = _ethertype.unpack_from(frame, offset + 2)[0]
+        offset += 4
+    return eth_type, offset
+
+
+# Returns (L4 protocol, offset of the L4 header) for an IPv4 header at offset, or (None, 0)
+# if the payload is not dissected (non-first fragments, truncated headers)
+def _ipv4_l4(frame, offset):
+    ihl = (frame[offset] & 0x0F) * 4
+    frag = struct.unpack_from("!H", frame, offset + 6)[0] & 0x1FFF
+    if frag or ihl < 20:
+        return None, 0
+    return frame[offset + 9], offset + ihl
+
+
+def _ipv6_l4(frame, offset):
+    nh = frame[offset + 6]
+    offset += 40
+    while nh in IPV6_EXT_HEADERS or nh == IPV6_FRAGMENT:
+        if len(frame) < offset + 8:
+            return None, 0
+        if nh == IPV6_FRAGMENT:
+            if struct.unpack_from("!H", frame, offset + 2)[0] & 0xFFF8:  # not the first fragment
+                return None, 0
+            nh = frame[offset]
+            offset += 8
+        else:
+            nh, hlen = frame[offset], frame[offset + 1]
+            offset += (hlen + 1) * 8
+    return nh, offset
+
+
+# Parses one Ethernet frame into the tuple consumed by netStat.updateGetStats:
+# (IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, framelen, timestamp)
+# The field semantics mirror my_feature_extractor.packet_fields() on a scapy-dissected packet.
+def parse_frame(frame, timestamp):
+    IPtype = np.nan
+    srcIP, dstIP = '', ''
+    srcproto, dstproto = '', ''
+    srcMAC = frame[6:12].hex(':')
+    dstMAC = frame[0:6].hex(':')
+
+    eth_type, offset = _l3_offset(frame)
+    l4, l4_offset = None, 0
+    if eth_type == ETH_P_IP and len(frame) >= offset + 20:
+        srcIP = socket.inet_ntoa(frame[offset + 12:offset + 16])
+        dstIP = socket.inet_ntoa(frame[offset + 16:offset + 20])
+        IPtype = 0
+        l4, l4_offset = _ipv4_l4(frame, offset)
+    elif eth_type == ETH_P_IPV6 and len(frame) >= offset + 40:
+        srcIP = socket.inet_ntop(socket.AF_INET6, frame[offset + 8:offset + 24])
+        dstIP = socket.inet_ntop(socket.AF_INET6, frame[offset + 24:offset + 40])
+        IPtype = 1
+        l4, l4_offset = _ipv6_l4(frame, offset)
+
+    if l4 in (IPPROTO_TCP, IPPROTO_UDP) and len(frame) >= l4_offset + 4:
+        sport, dport = _ports.unpack_from(frame, l4_offset)
+        srcproto = str(sport)
+        dstproto = str(dport)
+    elif eth_type == ETH_P_ARP and len(frame) >= offset + 28:
+        srcproto = dstproto = 'arp'
+        srcIP = socket.inet_ntoa(frame[offset + 14:offset + 18])
+        dstIP = socket.inet_ntoa(frame[offset + 24:offset + 28])
+        IPtype = 0
+    elif l4 == IPPROTO_ICMP and IPtype == 0:
+        srcproto = dstproto = 'icmp'
+        IPtype = 0
+
+    return IPtype, srcMAC, dstMAC, srcIP, srcproto, dstIP, dstproto, len(frame), timestamp
+
+
+# (src, dst, protocol number) of an IPv4 frame, or None. Used for the detection log.
+def ipv4_summary(frame):
+    eth_type, offset = _l3_offset(frame)
+    if eth_type != ETH_P_IP or len(frame) < offset + 20:
+        return None
+    return (socket.inet_ntoa(frame[offset + 12:offset + 16]),
+            socket.inet_ntoa(frame[offset + 16:offset + 20]),
+            frame[offset + 9])
+
+
+# Live capture of undissected frames. Uses scapy's L2 listen socket only for the BPF filter
+# and recv_raw(), which returns the raw bytes without building a Packet.
+class RawCapture:
+    def __init__(self, iface=None, bpf_filter=None, snaplen=MTU):
+        self.iface = iface
+        self.bpf_filter = bpf_filter
+        self.snaplen = snaplen
+        self.sock = None
+
+    def __enter__(self):
+        self.sock = conf.L2listen(iface=self.iface, filter=self.bpf_filter)
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def __iter__(self):
+        if self.sock is None:
+            self.__enter__()
+        while self.sock is not None:
+            _, frame, ts = self.sock.recv_raw(self.snaplen)
+            if frame is None:
+                continue
+            yield frame, (ts if ts is not None else time())
+
+
+# Reads undissected frames and their capture timestamps from a pcap/pcapng file
+def iter_pcap_frames(path):
+    with RawPcapReader(path) as reader:
+        for frame, meta in reader:
+            if hasattr(meta, 'usec'):  # pcap
+                ts = meta.sec + meta.usec / 1e6
+            else:  # pcapng
+                ts = ((meta.tshigh << 32) | meta.tslow) / meta.tsresol
+            yield frame, ts
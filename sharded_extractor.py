@@ -0,0 +1,178 @@
+import os
+import queue
+import threading
+import time
+import zlib
+import multiprocessing as mp
+
+# Flow-hash sharded feature extraction.
+# Packets are routed by a hash of their host pair (or source host) to one of N worker processes,
+# each running its own LiveFeatureExtractor with private netStat/incStatDB tables, so extraction
+# scales past the single core the GIL allows. Results from all shards go to one shared queue.
+#
+# Which statistics stay exact under the partitioning (vs. a single extractor):
+#
+#   shard_key="pair" (unordered srcIP/dstIP pair, both directions on the same shard)
+#     exact:   HH_jit (keyed by the directed host pair)
+#              HpHp 1D + 2D, as long as each source socket talks to a single destination host
+#              (always true for TCP; UDP servers answering many hosts from one port are split)
+#     approx.: MI_dir and HH 1D (a host's traffic to several peers is split across shards)
+#              HH 2D radius/magnitude/cov/pcc (built on the per-host HH streams, which are split)
+#
+#   shard_key="src" (source host only)
+#     exact:   MI_dir, HH 1D, HH_jit, HpHp 1D
+#     approx.: HH and HpHp 2D radius/magnitude/cov/pcc (the reverse direction lives on another shard)
+#
+# The 1500 AfterImage expansion in LiveFeatureExtractor (one decayed stream per base feature over
+# all packets) is never exact when sharded: each shard only sees its own share of the traffic.
+#
+# Workers are started with the "spawn" method on every platform (Linux defaults to "fork"): the sniffer loads
+# TensorFlow and its models before starting them, and forking a process with TensorFlow's threads running can
+# deadlock the child and duplicates the parent's memory. Spawned workers re-import the main module, so scripts
+# that start them keep their own startup under `if __name__ == "__main__":`.
+#
+# With a state_dir every worker restores its statistics from "<state_dir>/shard-<i>-of-<n>" on start and
+# snapshots them there every checkpoint_interval seconds (between packets) and on checkpoint().
+
+_CHECKPOINT = "checkpoint"
+
+
+def default_workers():
+    # leave one core for capture and one for inference
+    return max(1, (os.cpu_count() or 2) - 2)
+
+
+def shard_of(fields, n_shards, shard_key="pair"):
+    srcIP, dstIP = fields[3], fields[5]
+    if shard_key == "src":
+        key = srcIP
+    elif srcIP <= dstIP:
+        key = srcIP + "|" + dstIP
+    else:
+        key = dstIP + "|" + srcIP
+    return zlib.crc32(key.encode()) % n_shards
+
+
+def _save_shard(extractor, state_path):
+    try:
+        extractor.save_state(state_path)
+    except Exception as e:
+        print(f"❌ Could not checkpoint {state_path}:", e)
+
+
+# Worker process: owns one extractor, turns (fields, tag) into (tag, timestamp, features)
+def _shard_worker(in_q, out_q, extractor_kwargs, state_path=None, checkpoint_interval=60):
+    from my_feature_extractor import LiveFeatureExtractor
+    from kitsune_core.NetStatSnapshot import snapshot_exists
+    extractor = LiveFeatureExtractor(**extractor_kwargs)
+    if state_path is not None and snapshot_exists(state_path):
+        try:
+            extractor.load_state(state_path)
+        except Exception as e:
+            print(f"⚠️ Could not restore {state_path}, starting cold:", e)
+    last_checkpoint = time.time()
+    while True:
+        item = in_q.get()
+        if item is None:
+            out_q.put(None)
+            return
+        if state_path is not None and (item == _CHECKPOINT or
+                                       0 < checkpoint_interval <= time.time() - last_checkpoint):
+            _save_shard(extractor, state_path)
+            last_checkpoint = time.time()
+        if item == _CHECKPOINT:
+            continue
+        fields, tag, full = item
+        if not full:  # load shed: statistics only
+            extractor.update_only(fields)
+            continue
+        features = extractor.process_fields(fields)
+        if features is not None:
+            out_q.put((tag, fields[8], features))
+
+
+class ShardedFeatureExtractor:
+    # n_workers: number of extractor processes (default: cores - 2)
+    # depth: bound of each shard's input queue; packets are dropped (and counted) when it is full
+    # extractor_kwargs: passed to LiveFeatureExtractor in every worker
+    # state_dir / checkpoint_interval: where and how often (seconds) the workers snapshot their statistics
+    # start_method: multiprocessing start method of the workers ("spawn", or "forkserver" where available)
+    def __init__(self, n_workers=None, shard_key="pair", depth=10000, extractor_kwargs=None, state_dir=None,
+                 checkpoint_interval=60, start_method="spawn"):
+        if shard_key not in ("pair", "src"):
+            raise ValueError("shard_key must be 'pair' or 'src'")
+        self.n_workers = n_workers or default_workers()
+        self.shard_key = shard_key
+        self.extractor_kwargs = extractor_kwargs or {}
+        ctx = mp.get_context(start_method)
+        self.in_queues = [ctx.Queue(maxsize=depth) for _ in range(self.n_workers)]
+        self.out_queue = ctx.Queue(maxsize=depth * self.n_workers)
+        self.state_paths = [None if state_dir is None else
+                            os.path.join(state_dir, f"shard-{i}-of-{self.n_workers}") for i in range(self.n_workers)]
+        self.workers = [ctx.Process(target=_shard_worker,
+                                   args=(q, self.out_queue, self.extractor_kwargs, path, checkpoint_interval),
+                                   name=f"features-{i}", daemon=True)
+                        for i, (q, path) in enumerate(zip(self.in_queues, self.state_paths))]
+        self.enqueued = [0] * self.n_workers
+        self.dropped = [0] * self.n_workers
+        self.processed = 0
+        self.collector = None
+
+    # callback(tag, timestamp, features) is called from a collector thread for every result
+    def start(self, callback):
+        for w in self.workers:
+            w.start()
+        self.collector = threading.Thread(target=self._collect, args=(callback,), name="features-collector",
+                                          daemon=True)
+        self.collector.start()
+
+    # fields: the netStat tuple (see raw_capture.parse_frame); tag: any picklable value returned with the result
+    # full=False only updates the shard's statistics and produces no result (see sniffer_pipeline.LoadShedder)
+    def submit(self, fields, tag=None, full=True):
+        shard = shard_of(fields, self.n_workers, self.shard_key)
+        try:
+            self.in_queues[shard].put_nowait((fields, tag, full))
+        except queue.Full:
+            self.dropped[shard] += 1
+            return False
+        self.enqueued[shard] += 1
+        return True
+
+    def _collect(self, callback):
+        running = self.n_workers
+        while running:
+            result = self.out_queue.get()
+            if result is None:
+                running -= 1
+                continue
+            self.processed += 1
+            try:
+                callback(*result)
+            except Exception as e:
+                print("❌ Error handling sharded features:", e)
+
+    # Asks every worker to snapshot its statistics after the packets already queued (needs a state_dir)
+    def checkpoint(self, timeout=5):
+        for q in self.in_queues:
+            try:
+                q.put(_CHECKPOINT, timeout=timeout)
+            except queue.Full:
+                print("⚠️ Shard queue full, checkpoint request dropped")
+
+    def stop(self, timeout=5):
+        for q in self.in_queues:
+            q.put(None)
+        for w in self.workers:
+            w.join(timeout)
+        if self.collector is not None:
+            self.collector.join(timeout)
+
+    def stats(self):
+        return {
+            "workers": self.n_workers,
+            "enqueued": sum(self.enqueued),
+            "dropped": sum(self.dropped),
+            "processed": self.processed,
+            "per_shard_enqueued": list(self.enqueued),
+            "per_shard_dropped": list(self.dropped),
+        }
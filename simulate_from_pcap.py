@@ -1,52 +1,115 @@
 import os
 import time
+import argparse
+import numpy as np
 from collections import Counter
 from scapy.all import PcapReader
 from my_feature_extractor import LiveFeatureExtractor
-from voting_system import is_packet_malicious
+from voting_system import classify_batch, required_feature_indices
 from tqdm import tqdm
 
 # --- Configuration ---
 PCAP_FILE = "logs/Live_Data.pcap"
 LOG_FILE = "logs/simulation_from_real_report.txt"
 SIMULATION_DURATION = 600  # optional, affects sleep if re-added
+SPEED = 0  # 0 = as fast as possible, otherwise replay at SPEED x the recorded rate (1 = real time)
+VOTE_BATCH = 256  # feature vectors voted on per classify_batch() call
+
+
+# --- Replay Engine ---
+# Yields (packet, capture timestamp). Packets keep their recorded timestamps so AfterImage decay
+# windows match the capture regardless of host speed. With speed > 0 packets are released on the
+# recorded schedule scaled by speed; lag_stats tracks how far processing falls behind that schedule.
+def replay(reader, speed=0, lag_stats=None):
+    first_ts = start = None
+    for pkt in reader:
+        ts = float(pkt.time)
+        if speed > 0:
+            if first_ts is None:
+                first_ts, start = ts, time.perf_counter()
+            delay = (ts - first_ts) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            elif lag_stats is not None:
+                lag_stats["max_lag"] = max(lag_stats["max_lag"], -delay)
+                lag_stats["late_packets"] += 1
+        yield pkt, ts
+
 
 # --- Simulation ---
-def simulate_from_real():
+def simulate_from_real(pcap_file=PCAP_FILE, speed=SPEED, vote_batch=VOTE_BATCH):
     os.makedirs("logs", exist_ok=True)
-    if not os.path.exists(PCAP_FILE):
-        print(f"❌ PCAP file not found: {PCAP_FILE}")
+    if not os.path.exists(pcap_file):
+        print(f"❌ PCAP file not found: {pcap_file}")
         return
 
-    extractor = LiveFeatureExtractor()
+    extractor = LiveFeatureExtractor(required_features=required_feature_indices())
     detections = []
+    pending = []  # feature vectors not voted on yet
+
+    def vote():
+        for detected, attack_type in classify_batch(np.stack(pending), verbose=False):
+            if detected:
+                detections.append(attack_type)
+        pending.clear()
+
     total_packets = 0
+    first_ts = last_ts = None
+    lag_stats = {"max_lag": 0.0, "late_packets": 0}
 
-    print(f"📥 Reading from {PCAP_FILE}")
-    with PcapReader(PCAP_FILE) as reader:
-        for pkt in tqdm(reader, desc="💡 Simulating Real PCAP", unit="pkt"):
-            timestamp = time.time()
+    mode = f"{speed:g}x recorded rate" if speed > 0 else "as fast as possible"
+    print(f"📥 Reading from {pcap_file} ({mode})")
+    start = time.perf_counter()
+    with PcapReader(pcap_file) as reader:
+        for pkt, timestamp in tqdm(replay(reader, speed, lag_stats), desc="💡 Simulating Real PCAP", unit="pkt"):
+            if first_ts is None:
+                first_ts = timestamp
+            last_ts = timestamp
             vector = extractor.process_packet(pkt, timestamp)
             total_packets += 1
             if vector is not None:
-                detected, attack_type = is_packet_malicious(vector, verbose=False)
-                if detected:
-                    detections.append(attack_type)
+                pending.append(vector)
+                if len(pending) >= vote_batch:
+                    vote()
+        if pending:
+            vote()
+    elapsed = time.perf_counter() - start
 
     # --- Report ---
     malicious_detected = len(detections)
     attack_counts = Counter(detections)
+    capture_duration = (last_ts - first_ts) if total_packets else 0.0
+    achieved_pps = total_packets / elapsed if elapsed > 0 else 0.0
+    recorded_pps = total_packets / capture_duration if capture_duration > 0 else 0.0
+    # >1 means the pipeline processes the capture faster than it was recorded
+    realtime_factor = capture_duration / elapsed if elapsed > 0 else 0.0
 
     with open(LOG_FILE, "w", encoding="utf-8") as f:
-        f.write("Simulation from Live_Data.pcap\n")
+        f.write(f"Simulation from {os.path.basename(pcap_file)}\n")
         f.write("==================================\n")
         f.write(f"Total packets: {total_packets}\n")
         f.write(f"Malicious packets detected: {malicious_detected}\n")
         for attack, count in attack_counts.items():
             percent = (count / total_packets) * 100
             f.write(f"- {attack}: {count} packets ({percent:.2f}%)\n")
+        f.write("\nReplay performance\n")
+        f.write("----------------------------------\n")
+        f.write(f"Replay mode: {mode}\n")
+        f.write(f"Capture duration: {capture_duration:.3f} s, wall time: {elapsed:.3f} s\n")
+        f.write(f"Recorded rate: {recorded_pps:.1f} pkt/s, achieved rate: {achieved_pps:.1f} pkt/s\n")
+        f.write(f"Real-time factor: {realtime_factor:.2f}x\n")
+        if speed > 0:
+            f.write(f"Packets behind schedule: {lag_stats['late_packets']}, max lag: {lag_stats['max_lag']:.3f} s\n")
 
+    print(f"⏱️ {achieved_pps:.1f} pkt/s achieved ({realtime_factor:.2f}x real time)")
     print(f"✅ Simulation complete. Report saved to {LOG_FILE}")
 
 if __name__ == "__main__":
-    simulate_from_real()
+    parser = argparse.ArgumentParser(description="Replay a pcap through the detection pipeline")
+    parser.add_argument("pcap", nargs="?", default=PCAP_FILE)
+    parser.add_argument("--speed", type=float, default=SPEED,
+                        help="replay speed multiplier (1 = real time, 10 = 10x); 0 = as fast as possible")
+    parser.add_argument("--batch", type=int, default=VOTE_BATCH,
+                        help="feature vectors per voting call (1 = vote packet by packet)")
+    args = parser.parse_args()
+    simulate_from_real(args.pcap, args.speed, args.batch)
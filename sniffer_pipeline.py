@@ -0,0 +1,324 @@
+import queue
+import threading
+import time
+
+# Staged capture -> features -> inference -> log pipeline.
+# Each stage owns a bounded input queue and a worker thread, so a slow stage fills its own
+# queue (and sheds load according to its drop policy) instead of stalling packet capture.
+
+DROP_POLICIES = ("block", "drop_newest", "drop_oldest")
+_STOP = object()
+
+
+class BoundedStage:
+    # handler(item) -> result for the next stage, or None to consume the item
+    # drop_policy: "block" waits for space, "drop_newest" discards the incoming item,
+    #              "drop_oldest" evicts the oldest queued item to make room
+    # max_batch: micro-batch the stage: handler(items) gets up to max_batch queued items, gathered for at most
+    # max_wait seconds after the first one arrives, and returns one result (or None) per item, in order
+    def __init__(self, name, handler, depth=10000, drop_policy="drop_oldest", output=None, max_batch=None,
+                 max_wait=0.0):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError("drop_policy must be one of " + str(DROP_POLICIES))
+        self.name = name
+        self.handler = handler
+        self.depth = depth
+        self.drop_policy = drop_policy
+        self.output = output
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.queue = queue.Queue(maxsize=depth)
+        self.enqueued = 0
+        self.dropped = 0
+        self.processed = 0
+        self.errors = 0
+        self.thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    # Returns False if the item was dropped
+    def submit(self, item):
+        if self.drop_policy == "block":
+            self.queue.put(item)
+        else:
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                if self.drop_policy == "drop_newest":
+                    self.dropped += 1
+                    return False
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+                try:
+                    self.queue.put_nowait(item)
+                except queue.Full:
+                    self.dropped += 1
+                    return False
+        self.enqueued += 1
+        return True
+
+    def stop(self):
+        self.queue.put(_STOP)
+
+    def _run(self):
+        if self.max_batch is not None:
+            return self._run_batched()
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                if self.output is not None:
+                    self.output.stop()
+                return
+            try:
+                result = self.handler(item)
+            except Exception as e:
+                self.errors += 1
+                print(f"❌ Error in {self.name} stage:", e)
+                continue
+            self.processed += 1
+            if result is not None and self.output is not None:
+                self.output.submit(result)
+
+    def _run_batched(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    remaining = deadline - time.monotonic()
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                results = self.handler(batch)
+            except Exception as e:
+                self.errors += len(batch)
+                print(f"❌ Error in {self.name} stage:", e)
+                continue
+            self.batches += 1
+            self.processed += len(batch)
+            if self.output is not None:
+                for result in results:
+                    if result is not None:
+                        self.output.submit(result)
+        if self.output is not None:
+            self.output.stop()
+
+    def stats(self):
+        stats = {
+            "depth": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "processed": self.processed,
+            "errors": self.errors,
+        }
+        if self.max_batch is not None:
+            stats["batches"] = self.batches
+        return stats
+
+
+class SnifferPipeline:
+    # extract(item) -> features item, classify(item) -> detection or None, write_log(detection)
+    # depths / drop_policies: optional per-stage overrides keyed by "features", "inference", "log"
+    # inference_batch: classify(items) is called on micro-batches of up to inference_batch items gathered
+    # for at most inference_wait seconds and returns a list of detections/None (see BoundedStage)
+    def __init__(self, extract, classify, write_log, depths=None, drop_policies=None, inference_batch=None,
+                 inference_wait=0.0):
+        depths = depths or {}
+        drop_policies = drop_policies or {}
+        self.log_stage = BoundedStage("log", write_log,
+                                      depths.get("log", 1000), drop_policies.get("log", "block"))
+        self.inference_stage = BoundedStage("inference", classify,
+                                            depths.get("inference", 10000),
+                                            drop_policies.get("inference", "drop_oldest"),
+                                            output=self.log_stage, max_batch=inference_batch,
+                                            max_wait=inference_wait)
+        self.feature_stage = BoundedStage("features", extract,
+                                          depths.get("features", 10000),
+                                          drop_policies.get("features", "drop_oldest"),
+                                          output=self.inference_stage)
+        self.stages = [self.feature_stage, self.inference_stage, self.log_stage]
+        self.captured = 0
+        self.capture_thread = None
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    # Capture callback: hands one captured item to the feature stage
+    def submit(self, item):
+        self.captured += 1
+        return self.feature_stage.submit(item)
+
+    # Runs capture in its own thread, feeding every item of source into the pipeline
+    def capture(self, source):
+        def run():
+            for item in source:
+                self.submit(item)
+        self.capture_thread = threading.Thread(target=run, name="capture", daemon=True)
+        self.capture_thread.start()
+
+    # Drains the queues in order and waits for the stages to finish
+    def stop(self, timeout=5):
+        self.feature_stage.stop()
+        for stage in self.stages:
+            stage.thread.join(timeout)
+
+    def stats(self):
+        stats = {"capture": {"captured": self.captured}}
+        for stage in self.stages:
+            stats[stage.name] = stage.stats()
+        return stats
+
+    def format_stats(self):
+        parts = [f"captured={self.captured}"]
+        for stage in self.stages:
+            s = stage.stats()
+            part = (f"{stage.name}: depth={s['depth']}/{stage.depth} enq={s['enqueued']} "
+                    f"drop={s['dropped']} done={s['processed']}")
+            if "batches" in s:
+                part += f" batches={s['batches']}"
+            parts.append(part)
+        return "📊 " + " | ".join(parts)
+
+
+# Overload control for the feature stage.
+# While the inference queue is deeper than depth_threshold or packets reach the feature stage more than
+# latency_threshold seconds after capture, only a sampled subset of packets is sent on to inference.
+# The sampling rate halves every adjust_interval seconds while overloaded (down to min_rate) and doubles
+# back to 1.0 once load drops. Sampling is stratified per flow: every flow gets its own accumulator, so
+# the first packet of each flow is always admitted and busy flows cannot starve quiet ones.
+class LoadShedder:
+    def __init__(self, depth_threshold=5000, latency_threshold=0.5, min_rate=0.02, adjust_interval=0.5,
+                 max_flows=100000):
+        self.depth_threshold = depth_threshold
+        self.latency_threshold = latency_threshold
+        self.min_rate = min_rate
+        self.adjust_interval = adjust_interval
+        self.max_flows = max_flows
+        self.rate = 1.0
+        self.flows = {}  # flow key -> sampling accumulator
+        self.last_adjust = 0.0
+        self.admitted = 0
+        self.shed = 0
+        self.overload_episodes = 0
+
+    # direction-agnostic flow key from the netStat field tuple
+    @staticmethod
+    def flow_key(fields):
+        a = (fields[3], fields[4])  # srcIP, srcproto
+        b = (fields[5], fields[6])  # dstIP, dstproto
+        return (a, b) if a <= b else (b, a)
+
+    # Returns True if the packet should get the full feature vector and a vote
+    def admit(self, fields, queue_depth, latency, now):
+        if now - self.last_adjust >= self.adjust_interval:
+            self.last_adjust = now
+            overloaded = queue_depth >= self.depth_threshold or latency >= self.latency_threshold
+            if overloaded:
+                if self.rate == 1.0:
+                    self.overload_episodes += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+            elif self.rate < 1.0:
+                self.rate = min(1.0, self.rate * 2)
+                if self.rate == 1.0:
+                    self.flows.clear()
+
+        if self.rate == 1.0:
+            self.admitted += 1
+            return True
+
+        key = self.flow_key(fields)
+        acc = self.flows.get(key)
+        if acc is None:
+            if len(self.flows) >= self.max_flows:
+                self.flows.clear()
+            acc = 1.0  # new flows are always covered
+        else:
+            acc += self.rate
+        if acc >= 1.0:
+            self.flows[key] = acc - 1.0
+            self.admitted += 1
+            return True
+        self.flows[key] = acc
+        self.shed += 1
+        return False
+
+    def stats(self):
+        return {
+            "rate": self.rate,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "overload_episodes": self.overload_episodes,
+            "tracked_flows": len(self.flows),
+        }
+
+
+# Periodic background checkpoints of extractor state, so a restarted sniffer resumes with warm statistics.
+# capture() copies the state and runs under lock, which the feature stage also holds while it updates the
+# statistics, so the copy is consistent; write(state) then stores it from the checkpoint thread without
+# holding up extraction. interval: seconds between checkpoints (the thread isn't started if <= 0).
+class Checkpointer:
+    def __init__(self, capture, write, interval=60):
+        self.capture = capture
+        self.write = write
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()  # one checkpoint at a time: they all write to the same files
+        self.checkpoints = 0
+        self.errors = 0
+        self.capture_time = 0.0  # seconds of the last checkpoint spent holding the lock
+        self.write_time = 0.0
+        self._stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="checkpoint", daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self.thread.start()
+
+    # Takes and writes one checkpoint now (e.g. on shutdown)
+    def checkpoint(self):
+        with self.write_lock:
+            start = time.perf_counter()
+            with self.lock:
+                state = self.capture()
+            captured = time.perf_counter()
+            self.write(state)
+            self.capture_time = captured - start
+            self.write_time = time.perf_counter() - captured
+            self.checkpoints += 1
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                self.errors += 1
+                print("❌ Checkpoint failed:", e)
+
+    # Stops the periodic checkpoints, waiting for one in progress to finish
+    def stop(self):
+        self._stop.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def stats(self):
+        return {
+            "checkpoints": self.checkpoints,
+            "errors": self.errors,
+            "capture_time": self.capture_time,
+            "write_time": self.write_time,
+        }
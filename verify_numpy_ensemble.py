@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import numpy as np
+
+from voting_system import ModelRegistry, _vote
+from numpy_ensemble import NumpyEnsemble, NUMPY_CACHE_FILE
+
+# Parity and latency of the NumPy inference engine (numpy_ensemble.py) against the Keras models.
+# On random feature vectors, per model: the largest probability difference to model.predict(), and the
+# verdicts of both engines; then the median time to score a batch for a few batch sizes, and the time to
+# build the .npz cache from the .h5 files and to load it.
+# usage: python verify_numpy_ensemble.py [vectors]
+
+BATCH_SIZES = [1, 8, 64, 256]
+
+
+def median_time(fn, repeat=20):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.median(times)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    vs = ModelRegistry(engine="numpy", lazy=False)
+    models = ModelRegistry(engine="keras", lazy=False, warmup=False).models
+
+    X = np.random.default_rng(0).normal(0, 100, (n, len(vs.schema)))
+    selected = vs.numpy_columns.take(X)
+    numpy_probs = vs.numpy_model.predict(selected)[vs.numpy_order]
+    keras_probs = np.stack([
+        model.predict(vs.scalers[mf].transform(vs.model_columns[mf].take(X)), batch_size=n, verbose=0)[:, 0]
+        for mf, model in zip(vs.model_files, models)])
+    print(f"🔍 {n} random feature vectors")
+    for attack_key, a, b in zip(vs.attack_keys, numpy_probs, keras_probs):
+        print(f"  {attack_key:18s} max |numpy - keras| {np.abs(a - b).max():.2e}")
+    numpy_verdicts = _vote(vs.attack_keys, numpy_probs)
+    keras_verdicts = _vote(vs.attack_keys, keras_probs)
+    same = sum(a == b for a, b in zip(numpy_verdicts, keras_verdicts))
+    flagged = sum(a[0] == b[0] for a, b in zip(numpy_verdicts, keras_verdicts))
+    print(f"  malicious/benign identical for {flagged}/{n} vectors, with the same attack type for {same}/{n}")
+
+    print("⏱️ median time per batch")
+    for size in BATCH_SIZES:
+        batch = X[:size]
+        t_numpy = median_time(lambda: vs.classify_batch(batch))
+        t_keras = median_time(lambda: [model.predict(vs.scalers[mf].transform(vs.model_columns[mf].take(batch)),
+                                                     batch_size=size, verbose=0)
+                                       for mf, model in zip(vs.model_files, models)], repeat=3)
+        print(f"  {size:4d} vectors: numpy {t_numpy * 1000:9.3f} ms   keras predict {t_keras * 1000:9.1f} ms")
+
+    heads = [(mf, vs.model_columns[mf].columns.tolist(), vs.scalers[mf], os.path.join(vs.model_dir, mf))
+             for mf in vs.model_files]
+    start = time.perf_counter()
+    NumpyEnsemble.from_models(heads)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    NumpyEnsemble.load(os.path.join(vs.model_dir, NUMPY_CACHE_FILE))
+    print(f"📦 weights read from .h5 in {built:.3f}s, cached .npz loads in {time.perf_counter() - start:.3f}s")
+    print(vs.format_load_times())
@@ -0,0 +1,51 @@
+import sys
+import glob
+import math
+from scapy.all import Ether
+from raw_capture import parse_frame, iter_pcap_frames
+from my_feature_extractor import packet_fields
+
+# Parity check: the struct-based raw parser must produce the same netStat tuple as the
+# scapy-dissection path for every frame of the given pcaps.
+# Usage: python verify_raw_capture.py [file.pcap ...]   (defaults to pcap_files/*.pcap and logs/Live_Data.pcap)
+MAX_REPORTED = 10
+
+
+def same_fields(a, b):
+    for x, y in zip(a, b):
+        if isinstance(x, float) and isinstance(y, float) and math.isnan(x) and math.isnan(y):
+            continue
+        if x != y:
+            return False
+    return True
+
+
+def verify_pcap(path):
+    total = mismatches = 0
+    for frame, ts in iter_pcap_frames(path):
+        raw = parse_frame(frame, ts)
+        dissected = packet_fields(Ether(frame), ts)
+        total += 1
+        if not same_fields(raw, dissected):
+            mismatches += 1
+            if mismatches <= MAX_REPORTED:
+                print(f"  ❌ packet {total}:\n     raw:   {raw}\n     scapy: {dissected}")
+    return total, mismatches
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or sorted(glob.glob("pcap_files/*.pcap")) + glob.glob("logs/Live_Data.pcap")
+    if not paths:
+        print("❌ No pcap files found. Pass paths explicitly.")
+        sys.exit(1)
+
+    failed = False
+    for path in paths:
+        print(f"📥 Checking {path}")
+        total, mismatches = verify_pcap(path)
+        print(f"  {total - mismatches}/{total} packets match")
+        failed = failed or mismatches > 0
+
+    if failed:
+        sys.exit(1)
+    print("✅ Raw parser matches scapy on all packets.")
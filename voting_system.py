@@ -1,78 +1,356 @@
 import os
+import time
+import importlib
+import threading
 import numpy as np
 import joblib
-from tensorflow.keras.models import load_model
-from sklearn.preprocessing import StandardScaler
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from kitsune_core import netStat as ns
+from feature_schema import FeatureSchema
+import numpy_ensemble
 
-# Suppress TensorFlow logging
-os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-import tensorflow as tf
-tf.get_logger().setLevel('ERROR')
-
-# Load selected top-15 feature indices
-feature_map = {}
-selected_indices = []
-with open("top15features.csv", "r") as f:
-    for line in f:
-        parts = line.strip().split(',')
-        attack = parts[0].replace('_', ' ').lower()
-        indices = list(map(int, parts[1:]))
-        feature_map[attack] = indices
-        selected_indices.extend(indices)
-
-selected_indices = sorted(set(selected_indices))
-feature_to_offset = {fid: i * 15 for i, fid in enumerate(selected_indices)}
-
-# Load models and scalers
-model_dir = "models"
-model_files = [f for f in os.listdir(model_dir) if f.endswith(".h5")]
-models = [load_model(os.path.join(model_dir, mf)) for mf in model_files]
-scalers = {}
-for f in model_files:
-    scaler_path = os.path.join(model_dir, f"scaler_{f.replace('model_', '').replace('.h5', '')}.pkl")
-    scalers[f] = joblib.load(scaler_path)
-
-model_names = [mf.replace("model_", "").replace(".h5", "") for mf in model_files]
+# Inference engine: "keras" runs every model separately, "fused" the single multi-head model exported by
+# fused_ensemble.py (same probabilities, one forward pass per batch), "auto" the fused model if its export
+# is current and the separate models otherwise. "numpy" runs the models in NumPy from weights cached in
+# models/ensemble_numpy.npz (numpy_ensemble.py) and never imports TensorFlow; its probabilities match Keras
+# to about 1e-5 rather than bit for bit.
+VOTING_ENGINE = os.environ.get("NTB_VOTING_ENGINE", "auto")
+ENGINES = ("auto", "keras", "fused", "numpy")
 
-# Packet classifier using voting across models
-LAMBDA_VALUES = [5, 3, 1, 0.1, 0.01]
+# Defaults are relative to this file, not the working directory
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, "models")
+FEATURES_CSV = os.path.join(BASE_DIR, "top15features.csv")
+
+
+# The voting ensemble: the models in model_dir (model_<attack>.h5 with scaler_<attack>.pkl) and the feature IDs
+# each one reads from features_csv. The columns are resolved on construction, which is cheap; the scalers and
+# models (and TensorFlow, unless engine is "numpy") are loaded by load(), or on the first vote if lazy.
+# load() reads the files in parallel on `workers` threads, then votes once on a dummy batch so the first real
+# packet doesn't pay for graph tracing; load_times holds the seconds spent per file and on the warm-up.
+class ModelRegistry:
+    # short_circuit: see classify_batch()
+    def __init__(self, model_dir=MODEL_DIR, features_csv=FEATURES_CSV, engine=None, lazy=True, workers=4,
+                 warmup=True, short_circuit=False):
+        self.model_dir = model_dir
+        self.features_csv = features_csv
+        self.engine = engine or VOTING_ENGINE
+        if self.engine not in ENGINES:
+            raise ValueError("engine must be one of " + str(ENGINES))
+        self.workers = workers
+        self.warmup = warmup
+        self.short_circuit = short_circuit
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.load_times = {}
+        self.scalers = {}
+        self.models = []
+
+        # Load selected top-15 feature indices
+        self.feature_map = {}
+        selected_indices = []
+        with open(features_csv, "r") as f:
+            for line in f:
+                parts = line.strip().split(',')
+                attack = parts[0].replace('_', ' ').lower()
+                indices = list(map(int, parts[1:]))
+                self.feature_map[attack] = indices
+                selected_indices.extend(indices)
+        self.selected_indices = sorted(set(selected_indices))
+        self.feature_to_offset = {fid: i * 15 for i, fid in enumerate(self.selected_indices)}
+
+        self.model_files = sorted(f for f in os.listdir(model_dir) if f.endswith(".h5"))
+        self.model_names = [mf.replace("model_", "").replace(".h5", "") for mf in self.model_files]
+        self.attack_keys = [name.replace('_', ' ').lower() for name in self.model_names]
+
+        # Columns of the LiveFeatureExtractor vector each model reads. Each selected feature ID maps to the
+        # 15-column block at feature_to_offset[f_id] (its rank among all selected IDs times 15, the layout the
+        # models were trained against), not to schema.expansion_columns(f_id).
+        self.schema = FeatureSchema.from_netstat(ns.netStat())
+        self.model_columns = {}
+        for model_file, attack_key in zip(self.model_files, self.attack_keys):
+            columns = []
+            for f_id in self.feature_map.get(attack_key, []):
+                if f_id in self.feature_to_offset:
+                    offset = self.feature_to_offset[f_id]
+                    columns.extend(range(offset, offset + 15))
+            self.model_columns[model_file] = self.schema.select(columns)
+
+        self.reset_vote_stats()
+
+        if not lazy:
+            self.load()
+
+    def scaler_path(self, model_file):
+        return os.path.join(self.model_dir, f"scaler_{model_file.replace('model_', '').replace('.h5', '')}.pkl")
+
+    # Feature vector columns read by any model, for LiveFeatureExtractor(required_features=...)
+    def required_feature_indices(self):
+        columns = set()
+        for selection in self.model_columns.values():
+            columns.update(selection.columns.tolist())
+        return sorted(columns)
+
+    def _timed(self, name, load, *args):
+        start = time.perf_counter()
+        result = load(*args)
+        self.load_times[name] = time.perf_counter() - start
+        return result
+
+    def load(self):
+        with self.lock:
+            if not self.loaded:
+                self._load()
+        return self
+
+    def _load(self):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max(1, self.workers)) as pool:
+            scalers = pool.map(lambda mf: self._timed(os.path.basename(self.scaler_path(mf)), joblib.load,
+                                                      self.scaler_path(mf)), self.model_files)
+            self.scalers = dict(zip(self.model_files, scalers))
+
+            if self.engine != "numpy":
+                # Suppress TensorFlow logging
+                os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+                tf = self._timed("tensorflow", importlib.import_module, "tensorflow")
+                tf.get_logger().setLevel('ERROR')
+                import fused_ensemble
+            if self.engine == "auto":
+                current = fused_ensemble.is_current(self.model_dir, self.model_files, self.features_csv)
+                self.engine = "fused" if current else "keras"
+
+            if self.engine == "fused":
+                self.fused_model, self.fused_meta = self._timed(fused_ensemble.FUSED_MODEL_FILE,
+                                                                fused_ensemble.load_fused, self.model_dir)
+                if sorted(self.fused_meta["model_files"]) != self.model_files:
+                    raise ValueError(f"{fused_ensemble.FUSED_MODEL_FILE} was exported from other models, "
+                                     f"re-run fused_ensemble.py")
+                self.fused_columns = self.schema.select(self.fused_meta["columns"])
+                # output of each model
+                self.fused_order = [self.fused_meta["model_files"].index(mf) for mf in self.model_files]
+            elif self.engine == "numpy":
+                heads = [(mf, self.model_columns[mf].columns.tolist(), self.scalers[mf],
+                          os.path.join(self.model_dir, mf)) for mf in self.model_files]
+                self.numpy_model = self._timed(numpy_ensemble.NUMPY_CACHE_FILE, numpy_ensemble.load_cached,
+                                               self.model_dir, heads, self.features_csv)
+                self.numpy_columns = self.schema.select(self.numpy_model.columns)
+                # output row of each model
+                self.numpy_order = [self.numpy_model.model_files.index(mf) for mf in self.model_files]
+            else:
+                from tensorflow.keras.models import load_model
+                paths = [os.path.join(self.model_dir, mf) for mf in self.model_files]
+                self.models = list(pool.map(lambda mf, path: self._timed(mf, load_model, path),
+                                            self.model_files, paths))
+        self.loaded = True
+        self.load_times["total"] = time.perf_counter() - start
+
+        if self.warmup:
+            # (on the path real batches take, so that is the one traced; its dummy packet and first-call costs
+            # must not count towards vote_stats() or model_order())
+            self._timed("warm-up", self.classify_batch, np.zeros((1, len(self.schema))))
+            self.reset_vote_stats()
+
+    # short-circuit evaluation counters: packets and batches voted on, model evaluations (one per model
+    # per packet) and, per model, predict calls, packets scored, seconds spent and high-confidence (>= 0.90) outputs
+    def reset_vote_stats(self):
+        self.voted = 0
+        self.batches = 0
+        self.evaluations = 0
+        self.calls = np.zeros(len(self.model_files), dtype=np.int64)
+        self.scored = np.zeros(len(self.model_files), dtype=np.int64)
+        self.seconds = np.zeros(len(self.model_files))
+        self.hits = np.zeros(len(self.model_files), dtype=np.int64)
+
+    def format_load_times(self):
+        times = " ".join(f"{name}={seconds:.2f}s" for name, seconds in self.load_times.items())
+        return f"🧠 {self.engine} engine, {len(self.model_files)} models: {times}"
+
+    # Votes on a batch of packets with one predict call per model (one in total with the fused engine).
+    # features: (N, n_features) matrix, one feature vector per packet. Returns one
+    # (is_malicious, attack_type) verdict per row, in order, each what is_packet_malicious() returns for that row.
+    # With short_circuit (keras and numpy engines; the fused model is a single call anyway) the models run one
+    # at a time, cheapest and most often decisive first, each on the packets whose verdict is still open; a
+    # packet drops out once it is known to be malicious and its attack type is fixed, so the verdicts don't
+    # change. attribution=False drops it as soon as it is known to be malicious, and its attack type is the most
+    # likely among the models evaluated so far (for alerts where the exact attack type matters less).
+    # A benign verdict always takes every model, since any of them could still reach 0.90.
+    def classify_batch(self, features, verbose=False, attribution=True):
+        if not self.loaded:
+            self.load()
+        features = np.asarray(features)
+        if len(features) == 0:
+            return []
+        if self.engine == "fused":
+            # (every head fails together, so there is no one left to vote, as when all separate models fail)
+            try:
+                selected_features = self.fused_columns.take(features)
+                head_probs = self.fused_model.predict_on_batch(selected_features)  # (see fused_ensemble)
+            except Exception as e:
+                print(f"⚠️ Error processing the fused ensemble: {e}")
+                return [(False, None)] * len(features)
+            return _vote(self.attack_keys, np.stack([head_probs[k][:, 0] for k in self.fused_order]))
+        if self.short_circuit:
+            return self._classify_short_circuit(features, attribution)
+        if self.engine == "numpy":
+            probs = self.numpy_model.predict(self.numpy_columns.take(features))
+            return _vote(self.attack_keys, probs[self.numpy_order])
+        voters = []
+        probs = []
+
+        for model_file, attack_key, model in zip(self.model_files, self.attack_keys, self.models):
+            try:
+                selected_features = self.model_columns[model_file].take(features)
+
+                scaler = self.scalers[model_file]
+                scaled_features = scaler.transform(selected_features)
 
+                vote_probs = model.predict(scaled_features, batch_size=len(scaled_features))[:, 0]
+                voters.append(attack_key)
+                probs.append(vote_probs)
+            except Exception as e:
+                print(f"⚠️ Error processing {attack_key}: {e}")
+                continue
+
+        if not voters:
+            return [(False, None)] * len(features)
+        return _vote(voters, np.stack(probs))
+
+    # Probabilities of model m (an index into model_files) for the rows of features
+    def _predict_model(self, m, features):
+        if self.engine == "numpy":
+            return self.numpy_model.predict_head(self.numpy_order[m], self.numpy_columns.take(features))
+        model_file = self.model_files[m]
+        scaled_features = self.scalers[model_file].transform(self.model_columns[model_file].take(features))
+        return self.models[m].predict(scaled_features, batch_size=len(scaled_features))[:, 0]
+
+    # Evaluation order: highest high-confidence rate per second of predict time first (a model never run yet
+    # counts as free, so every model gets measured)
+    def model_order(self):
+        hit_rate = (self.hits + 1) / (self.scored + 2)
+        cost = np.divide(self.seconds, self.calls, out=np.zeros(len(self.calls)), where=self.calls > 0)
+        return np.argsort(-hit_rate / (cost + 1e-9), kind="stable")
+
+    def _classify_short_circuit(self, features, attribution):
+        n_models = len(self.model_files)
+        threshold = int(n_models * 0.7)
+        probs = np.zeros((n_models, len(features)), dtype=np.float32)
+        done = np.zeros((n_models, len(features)), dtype=bool)  # evaluated, or failed for the whole batch
+        voting = np.ones(n_models, dtype=bool)  # False for a model that failed
+        high_confidence = np.zeros(len(features), dtype=bool)
+        majority = np.zeros(len(features), dtype=np.int64)
+        decided = {}  # row -> attack type of a packet that dropped out early
+        open_rows = np.arange(len(features))
+
+        for m in self.model_order():
+            if len(open_rows) == 0:
+                break
+            start = time.perf_counter()
+            try:
+                p = self._predict_model(m, features[open_rows])
+            except Exception as e:
+                print(f"⚠️ Error processing {self.attack_keys[m]}: {e}")
+                voting[m] = False
+                done[m] = True
+                continue
+            self.seconds[m] += time.perf_counter() - start
+            self.calls[m] += 1
+            self.scored[m] += len(open_rows)
+            self.hits[m] += int((p >= 0.90).sum())
+            self.evaluations += len(open_rows)
+            probs[m, open_rows] = p
+            done[m, open_rows] = True
+            high_confidence[open_rows] |= p >= 0.90
+            majority[open_rows] += p >= 0.5
+
+            still_open = []
+            for row in open_rows:
+                if not (high_confidence[row] or majority[row] >= threshold):
+                    still_open.append(row)
+                    continue
+                attack = self._fixed_attack(probs[:, row], done[:, row], voting, attribution)
+                if attack is None:
+                    still_open.append(row)
+                else:
+                    decided[row] = attack
+            open_rows = np.array(still_open, dtype=np.intp)
+
+        self.voted += len(features)
+        self.batches += 1
+        if not voting.any():
+            return [(False, None)] * len(features)
+        voters = [key for key, v in zip(self.attack_keys, voting) if v]
+        full = dict(zip(open_rows.tolist(), _vote(voters, probs[voting][:, open_rows])))
+        return [full[row] if row in full else (True, decided[row]) for row in range(len(features))]
+
+    # Attack type of a packet already known to be malicious, if the models evaluated so far fix it: the vote
+    # takes the first model (in model_files order) with the highest probability, and no later model can beat a
+    # prefix maximum of 1.0 (or NaN). None if it is still open.
+    def _fixed_attack(self, probs, done, voting, attribution):
+        if not attribution:
+            return self.attack_keys[max(np.flatnonzero(voting & done), key=lambda m: probs[m])]
+        prefix = []  # the leading models in model_files order that have voted
+        for m in range(len(self.model_files)):
+            if not done[m]:
+                break
+            if voting[m]:
+                prefix.append(m)
+        if not prefix:
+            return None
+        best = max(prefix, key=lambda m: probs[m])
+        if done.all() or probs[best] == 1.0 or np.isnan(probs[best]):
+            return self.attack_keys[best]
+        return None
+
+    # Model evaluations and predict calls saved by short-circuit voting
+    def vote_stats(self):
+        evaluations = self.voted * len(self.model_files)
+        calls = self.batches * len(self.model_files)
+        return {
+            "packets": self.voted,
+            "evaluations_saved": evaluations - self.evaluations,
+            "evaluations_saved_fraction": (evaluations - self.evaluations) / evaluations if evaluations else 0.0,
+            "calls_saved": calls - int(self.calls.sum()),
+            "order": [self.attack_keys[m] for m in self.model_order()],
+        }
+
+    def format_vote_stats(self):
+        s = self.vote_stats()
+        return (f"🗳️ short-circuit voting: {s['packets']} packets, {s['evaluations_saved']} model evaluations "
+                f"({s['evaluations_saved_fraction']:.1%}) and {s['calls_saved']} predict calls saved, "
+                f"order {', '.join(s['order'])}")
+
+    def is_packet_malicious(self, features, verbose=False):
+        return self.classify_batch(np.asarray(features).reshape(1, -1), verbose)[0]
+
+
+# voters: attack key of each model that voted, probs: (models, N) probabilities
+def _vote(voters, probs):
+    high_confidence = (probs >= 0.90).any(axis=0)
+    majority_vote = (probs >= 0.5).sum(axis=0) >= int(len(voters) * 0.7)
+
+    verdicts = []
+    for k, flagged in enumerate(high_confidence | majority_vote):
+        if flagged:
+            attack_probs = dict(zip(voters, probs[:, k]))
+            most_likely_attack = max(attack_probs, key=attack_probs.get)
+            verdicts.append((True, most_likely_attack))
+        else:
+            verdicts.append((False, None))
+    return verdicts
+
+
+# Default ensemble; the models are loaded on the first vote (or registry.load())
+registry = ModelRegistry()
+
+
+def required_feature_indices():
+    return registry.required_feature_indices()
+
+# Packet classifier using voting across models
 def is_packet_malicious(features, verbose=False):
-    features = np.array(features).reshape(1, -1)
-    votes = []
-    attack_probs = {}
-
-    for model_file, model in zip(model_files, models):
-        attack_key = model_file.replace("model_", "").replace(".h5", "").replace('_', ' ').lower()
-        base_indices = feature_map.get(attack_key, [])
-
-        selected_afterimage_indices = []
-        for f_id in base_indices:
-            if f_id in feature_to_offset:
-                offset = feature_to_offset[f_id]
-                selected_afterimage_indices.extend(range(offset, offset + 15))
-        try:
-            selected_features = features[:, selected_afterimage_indices]
-
-            scaler = scalers[model_file]
-            scaled_features = scaler.transform(selected_features)
-
-            vote_prob = model.predict(scaled_features)[0][0]
-            attack_probs[attack_key] = vote_prob
-            votes.append(vote_prob)
-        except Exception as e:
-            print(f"⚠️ Error processing {attack_key}: {e}")
-            continue
-
-    if not attack_probs:
-        return False, None
-
-    high_confidence = any(v >= 0.90 for v in votes)
-    majority_vote = sum(v >= 0.5 for v in votes) >= int(len(votes) * 0.7)
-
-    if high_confidence or majority_vote:
-        most_likely_attack = max(attack_probs, key=attack_probs.get)
-        return True, most_likely_attack
-    else:
-        return False, None
+    return registry.is_packet_malicious(features, verbose)
+
+def classify_batch(features, verbose=False, attribution=True):
+    return registry.classify_batch(features, verbose, attribution)